@@ -0,0 +1,174 @@
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import numpy as np
+import psm.filter
+
+line_parameters = ('image_size', 'filter_radius', 'filter_noise',
+                   'image_angle')
+artifact_line_parameters = ('image_size', 'artifact_size', 'filter_radius',
+                            'filter_noise', 'image_samples', 'image_angle')
+
+
+def configurations(kind, sweep):
+    names = line_parameters if kind == 'Line' else artifact_line_parameters
+    for values in itertools.product(*[sweep[n] for n in names]):
+        yield dict(zip(names, values))
+
+
+def render(drawer, kind, config, result, line_angle, filter_samples):
+    size = config['image_size']
+    if kind == 'Line':
+        drawer(size / 2, size / 2, line_angle, config['filter_radius'],
+               config['filter_noise'], filter_samples, config['image_angle'],
+               result=result)
+    else:
+        drawer(size / 2, size / 2, line_angle, config['artifact_size'],
+               config['filter_radius'], config['filter_noise'],
+               filter_samples, 0.1, config['image_angle'],
+               config['image_samples'], result=result)
+
+
+def measure(drawer, kind, config, repeats, line_angle, filter_samples):
+    size = config['image_size']
+    result = np.empty((size, size, 4), np.uint8)
+    # the first call includes building the work group sizes and buffers
+    render(drawer, kind, config, result, line_angle, filter_samples)
+    kernel, transfer, wall = [], [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        render(drawer, kind, config, result, line_angle, filter_samples)
+        wall.append(time.perf_counter() - start)
+        times = psm.filter.event_times(drawer.events)
+        kernel.append(
+            sum(t for n, t in times.items()
+                if n not in ('copy', 'acquire', 'release')))
+        transfer.append(times.get('copy', 0.0))
+    return {
+        'kernel_ms': 1000 * float(np.median(kernel)),
+        'transfer_ms': 1000 * float(np.median(transfer)),
+        'wall_ms': 1000 * float(np.median(wall)),
+        'kernel_min_ms': 1000 * float(np.min(kernel))
+    }
+
+
+def run(sweep, kinds=('Line', 'ArtifactLine'), repeats=5, line_angle=0.3,
+        filter_samples=100.0, options=None, verbose=True):
+    psm.filter.init_opencl(sharing=False, profiling=True)
+    device = psm.filter.context.devices[0]
+    results = []
+    for kind in kinds:
+        drawers = {}
+        for config in configurations(kind, sweep):
+            size = config['image_size']
+            if size not in drawers and kind == 'Line':
+                drawers[size] = psm.filter.Line(
+                    size, size,
+                    noise_field=(options or {}).get('noise_field', False))
+            elif size not in drawers:
+                drawers[size] = psm.filter.ArtifactLine(
+                    size, size, **(options or {}))
+            timing = measure(drawers[size], kind, config, repeats, line_angle,
+                             filter_samples)
+            results.append({'kind': kind, **config, **timing})
+            if verbose:
+                print_result(results[-1])
+    return {
+        'device': device.name,
+        'platform': device.platform.name,
+        'driver': device.driver_version,
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'repeats': repeats,
+        'options': options or {},
+        'results': results
+    }
+
+
+def print_result(result):
+    config = ' '.join(f'{k}={result[k]:g}' for k in artifact_line_parameters
+                      if k in result)
+    print(f'{result["kind"]:12} {config:80} kernel {result["kernel_ms"]:9.2f} '
+          f'ms  transfer {result["transfer_ms"]:7.2f} ms')
+
+
+def _result_key(result):
+    return tuple(
+        (k, result.get(k)) for k in ('kind', ) + artifact_line_parameters)
+
+
+def compare(report, baseline, tolerance):
+    baseline = {_result_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        reference = baseline.get(_result_key(result))
+        if reference is None:
+            continue
+        # the fastest repeat is the least noisy on a shared machine
+        ratio = result['kernel_min_ms'] / max(reference['kernel_min_ms'],
+                                              1e-6)
+        if ratio > 1.0 + tolerance:
+            regressions.append((result, reference, ratio))
+    return regressions
+
+
+def parse_list(text):
+    return [
+        int(v) if v.lstrip('-').isdigit() else float(v)
+        for v in text.split(',')
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the psm OpenCL kernels.')
+    parser.add_argument('--kinds',
+                        nargs='+',
+                        default=['Line', 'ArtifactLine'],
+                        choices=['Line', 'ArtifactLine'])
+    parser.add_argument('--image-size', default='256,512')
+    parser.add_argument('--artifact-size', default='4,16')
+    parser.add_argument('--filter-radius', default='20,100')
+    parser.add_argument('--filter-noise', default='0,10')
+    parser.add_argument('--image-samples', default='1,4')
+    parser.add_argument('--image-angle', default='0,45', help='In degrees.')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--circle-area-table', action='store_true')
+    parser.add_argument('--line-staircase', action='store_true')
+    parser.add_argument('--sample-profile', action='store_true')
+    parser.add_argument('--noise-field', action='store_true')
+    parser.add_argument('--json', help='Write the report into a JSON file.')
+    parser.add_argument('--compare',
+                        help='Compare the kernel times with a JSON report.')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.2,
+                        help='Allowed relative slowdown against --compare.')
+    args = parser.parse_args(sys.argv[1:])
+
+    sweep = {
+        name: parse_list(getattr(args, name))
+        for name in artifact_line_parameters
+    }
+    sweep['image_angle'] = [np.deg2rad(a) for a in sweep['image_angle']]
+    options = {
+        k: True
+        for k in ('circle_area_table', 'line_staircase', 'sample_profile',
+                  'noise_field')
+        if getattr(args, k)
+    }
+    report = run(sweep, args.kinds, args.repeats, options=options)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for result, reference, ratio in regressions:
+            print(f'regression {ratio:.2f}x: ', end='')
+            print_result(result)
+        sys.exit(1 if regressions else 0)
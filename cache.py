@@ -0,0 +1,122 @@
+import collections
+import glob
+import hashlib
+import os
+import numpy as np
+
+cache_dir = os.environ.get(
+    'PSM_STIMULUS_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'psm', 'stimuli'))
+
+
+class StimulusCache:
+    def __init__(self,
+                 directory=None,
+                 max_bytes=4 * 2**30,
+                 radius_grain=0.01,
+                 offset_grain=50.0):
+        self._directory = cache_dir if directory is None else directory
+        self._max_bytes = max_bytes
+        self.radius_grain = radius_grain
+        self.offset_grain = offset_grain
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self._directory, exist_ok=True)
+
+        files = glob.glob(os.path.join(self._directory, '*.npy'))
+        files.sort(key=os.path.getmtime)
+        self._files = collections.OrderedDict(
+            (os.path.basename(f), os.path.getsize(f)) for f in files)
+        self._bytes = sum(self._files.values())
+        self._evict()
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, key):
+        return self._filename(key) in self._files
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def quantize_radius(self, filter_radius, grain=None):
+        # grain in pixels, the QUEST grain of a condition times its radius
+        if grain is None or grain <= 0:
+            grain = self.radius_grain
+        return round(filter_radius / grain) * grain
+
+    def quantize_offset(self, offset):
+        return round(offset / self.offset_grain) * self.offset_grain
+
+    def key(self, kind, image_size, artifact_size, line_angle, filter_radius,
+            filter_noise, filter_samples, image_samples, image_angle,
+            offset_x, offset_y, version=''):
+        # version identifies the renderer, see psm.filter.renderer_version
+        return (str(version), kind, int(image_size), int(artifact_size),
+                round(float(line_angle), 6),
+                round(float(filter_radius), 6),
+                round(float(filter_noise), 6), round(float(filter_samples), 6),
+                int(image_samples), int(round(image_angle / (np.pi / 2))) % 4,
+                int(round(offset_x / self.offset_grain)),
+                int(round(offset_y / self.offset_grain)))
+
+    def get(self, key):
+        filename = self._filename(key)
+        if filename not in self._files:
+            self.misses += 1
+            return None
+        path = os.path.join(self._directory, filename)
+        try:
+            image = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            self._remove(filename)
+            self.misses += 1
+            return None
+        os.utime(path)
+        self._files.move_to_end(filename)
+        self.hits += 1
+        return image
+
+    def touch(self, key):
+        # marks a cached image as used without loading it
+        filename = self._filename(key)
+        if filename not in self._files:
+            return False
+        os.utime(os.path.join(self._directory, filename))
+        self._files.move_to_end(filename)
+        return True
+
+    def put(self, key, image):
+        filename = self._filename(key)
+        path = os.path.join(self._directory, filename)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.save(file, np.ascontiguousarray(image))
+        os.replace(tmp_path, path)
+        if filename in self._files:
+            self._bytes -= self._files.pop(filename)
+        self._files[filename] = os.path.getsize(path)
+        self._bytes += self._files[filename]
+        self._evict()
+
+    def clear(self):
+        for filename in list(self._files):
+            self._remove(filename)
+
+    def _filename(self, key):
+        return hashlib.sha1(repr(key).encode()).hexdigest() + '.npy'
+
+    def _remove(self, filename):
+        self._bytes -= self._files.pop(filename)
+        path = os.path.join(self._directory, filename)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _evict(self):
+        while self._bytes > self._max_bytes and len(self._files) > 1:
+            self._remove(next(iter(self._files)))
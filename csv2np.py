@@ -1,31 +1,219 @@
+import concurrent.futures
+import csv
+import hashlib
+import json
+import os
 import numpy as np
 
+cache_dir = os.environ.get(
+    'PSM_TABLE_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'psm', 'tables'))
+
+# types of the columns written by quest.MultiQuest, other columns are inferred
+column_types = {
+    'artifact_size': int,
+    'beta': float,
+    'correct': int,
+    'delta': float,
+    'dropped_frames': int,
+    'duration': float,
+    'filter_noise': float,
+    'filter_radius': float,
+    'filter_radius_noise': float,
+    'filter_samples': float,
+    'frame_interval_max': float,
+    'frame_interval_mean': float,
+    'frame_interval_sd': float,
+    'frames': int,
+    'gamma': float,
+    'globalTrialId': int,
+    'grain': float,
+    'image_samples': int,
+    'intensity': float,
+    'intensityChange': str,
+    'is_reference': bool,
+    'label': str,
+    'line_angle': float,
+    'line_offset_x': float,
+    'line_offset_y': float,
+    'nTrials': int,
+    'noise_seed': int,
+    'onset_delay': float,
+    'pThreshold': float,
+    'questTrialId': int,
+    'range': float,
+    'selection': str,
+    'startVal': float,
+    'startValSd': float,
+    'stimulus_radius': float,
+    'stopInterval': float,
+    'user': str,
+    'velocity': float,
+    'x': float,
+    'y': float
+}
+_cache_version = 1
+
+
+def _to_number(values, dtype):
+    if '' in values:
+        # missing values turn integer columns into float columns
+        return np.array(['nan' if v == '' else v for v in values],
+                        np.float64)
+    return np.array(values, dtype)
+
+
+def _to_bool(values):
+    if '' in values:
+        bits = {'True': '1', 'False': '0'}
+        return _to_number([bits.get(v, v) for v in values], np.float64)
+    return np.array([v == 'True' or v == '1' for v in values], bool)
+
+
+def convert_column(values, column_type=None):
+    if column_type is str:
+        return np.asarray(values, dtype=str)
+    if column_type is bool:
+        return _to_bool(values)
+    if column_type is not None:
+        return _to_number(values, column_type)
+    if len(values) and set(values) <= {'True', 'False', ''}:
+        return _to_bool(values)
+    for dtype in (np.int64, np.float64):
+        try:
+            return _to_number(values, dtype)
+        except ValueError:
+            pass
+    return np.asarray(values, dtype=str)
+
+
+def load_file(filename, types=None):
+    types = column_types if types is None else types
+    with open(filename, newline='', encoding='utf-8') as file:
+        rows = list(csv.reader(file))
+    header, rows = rows[0], rows[1:]
+    n_columns = len(header)
+    rows = [r[:n_columns] + [''] * (n_columns - len(r)) for r in rows]
+    values = list(zip(*rows)) if rows else [()] * n_columns
+    return {
+        name: convert_column(list(v), types.get(name))
+        for name, v in zip(header, values)
+    }
+
+
+def merge_columns(*tables):
+    names = list(dict.fromkeys(n for t in tables for n in t))
+    lengths = [len(next(iter(t.values()))) if t else 0 for t in tables]
+    merged = {}
+    for name in names:
+        parts = [t.get(name) for t in tables]
+        dtypes = [p.dtype for p in parts if p is not None]
+        if any(d.kind == 'U' for d in dtypes):
+            # np.concatenate widens the strings to the longest one
+            merged[name] = np.concatenate([
+                np.full(n, '') if p is None else p.astype(str)
+                for p, n in zip(parts, lengths)
+            ])
+        else:
+            if len(dtypes) < len(parts):
+                dtypes.append(np.dtype(np.float64))
+            merged[name] = np.concatenate([
+                np.full(n, np.nan) if p is None else p
+                for p, n in zip(parts, lengths)
+            ]).astype(np.result_type(*dtypes))
+    return merged
+
 
 def merge_structured_arrays(*arrays):
-    columns = [t[0] for t in arrays[0].dtype.descr]
-    types = [t[1] for t in arrays[0].dtype.descr]
+    return to_structured_array(
+        merge_columns(*[{n: a[n] for n in a.dtype.names} for a in arrays]))
+
+
+def to_structured_array(columns):
+    n_rows = len(next(iter(columns.values()))) if columns else 0
+    dtype = np.dtype([(name, c.dtype) for name, c in columns.items()])
+    array = np.empty((n_rows, ), dtype=dtype)
+    for name, column in columns.items():
+        array[name] = column
+    return array
+
+
+def _file_stats(files):
+    return [[os.path.abspath(f),
+             os.stat(f).st_mtime_ns,
+             os.stat(f).st_size] for f in files]
+
+
+def _cache_folder(files, directory):
+    key = json.dumps([_cache_version] + [os.path.abspath(f) for f in files])
+    return os.path.join(directory, hashlib.sha1(key.encode()).hexdigest())
+
+
+def _read_cache(folder, files, types):
+    try:
+        with open(os.path.join(folder, 'manifest.json'), 'rt') as file:
+            manifest = json.load(file)
+        if (manifest['files'] != _file_stats(files) or
+                manifest['types'] != _types_key(types)):
+            return None
+        return {
+            name: np.load(os.path.join(folder, f'column-{i}.npy'),
+                          mmap_mode='r')
+            for i, name in enumerate(manifest['columns'])
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_cache(folder, files, types, columns):
+    os.makedirs(folder, exist_ok=True)
+    manifest_file = os.path.join(folder, 'manifest.json')
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    for i, column in enumerate(columns.values()):
+        np.save(os.path.join(folder, f'column-{i}.npy'), column)
+    # the manifest is written last, it marks the cache as complete
+    with open(f'{manifest_file}.tmp', 'wt') as file:
+        json.dump(
+            {
+                'files': _file_stats(files),
+                'types': _types_key(types),
+                'columns': list(columns)
+            }, file)
+    os.replace(f'{manifest_file}.tmp', manifest_file)
+
+
+def _types_key(types):
+    return sorted([name, t.__name__] for name, t in types.items())
 
-    for t in [a.dtype.descr for a in arrays[1:]]:
-        for i, v in enumerate(t):
-            types[i] = max(types[i], v[1])
 
-    dtype = np.dtype([(name, desc) for name, desc in zip(columns, types)])
+def load_columns(files, types=None, workers=None, cache=False):
+    files = list(files)
+    types = column_types if types is None else types
+    if cache:
+        directory = cache_dir if cache is True else cache
+        folder = _cache_folder(files, directory)
+        columns = _read_cache(folder, files, types)
+        if columns is not None:
+            return columns
 
-    array_out = np.empty((sum(len(a) for a in arrays), ), dtype=dtype)
-    i = 0
-    for a in arrays:
-        array_out[i:(i + a.shape[0])] = a
-        i += a.shape[0]
-    return array_out
+    if workers is None:
+        workers = min(len(files), os.cpu_count() or 1)
+    if workers <= 1:
+        tables = [load_file(f, types) for f in files]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            tables = list(executor.map(load_file, files, [types] * len(files)))
+    columns = merge_columns(*tables)
 
+    if cache:
+        try:
+            _write_cache(folder, files, types, columns)
+        except OSError:
+            # the cache is optional, the parsed columns are still valid
+            pass
+    return columns
 
-def load(files):
-    tables = [
-        np.genfromtxt(f,
-                      delimiter=',',
-                      names=True,
-                      dtype=None,
-                      encoding='utf-8') for f in files
-    ]
 
-    return merge_structured_arrays(*tables)
\ No newline at end of file
+def load(files, types=None, workers=None, cache=False):
+    return to_structured_array(load_columns(files, types, workers, cache))
@@ -1,14 +1,10 @@
 import argparse
 import glob
-import matplotlib.colors
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import sys
 import csv2np
-import figures
 import statistics
-import scipy.stats
 
 parser = argparse.ArgumentParser(description='Evaluate study data.')
 parser.add_argument(
@@ -30,9 +26,14 @@ parser.add_argument('--qqplot', help='Show the QQ-plot.', action="store_true")
 args = parser.parse_args(
     sys.argv[1:] if len(sys.argv) > 1 else ['--users', 'll', 'lw', 'mh'])
 
-files = glob.glob(os.path.join('data', '*.csv'))
+files = sorted(glob.glob(os.path.join('data', '*.csv')))
 
-table = csv2np.load(files)
+table = csv2np.load(files, cache=True)
+
+# matplotlib and scipy are only loaded by the options that plot
+if args.qqplot or args.boxplot or args.stairs or args.thresholds:
+    import matplotlib.pyplot as plt
+    import figures
 
 if args.nouser:
     table = table[table['user'] != args.nouser]
@@ -41,6 +42,7 @@ if args.users:
     pass
 
 if args.qqplot:
+    import scipy.stats
     data = table[table['is_reference'] == False]
     labels, radii, outlier = statistics.thresholds(data)
     if args.outlierremoval:
@@ -75,4 +77,5 @@ if args.thresholds:
     data = table[table['is_reference'] == False]
     figures.thresholds(data)
 
-plt.show()
+if args.qqplot or args.boxplot or args.stairs or args.thresholds:
+    plt.show()
@@ -1,6 +1,7 @@
 import numpy as np
 import matplotlib.colors
 import matplotlib.pyplot as plt
+import statistics
 
 
 def relabel(labels):
@@ -15,47 +16,43 @@ def relabel(labels):
     return np.array(labels)
 
 
-def stairs(data, legend=False):
-    user = data['user']
-    unique_user = np.unique(data['user'])
-    label = data['label']
-    unique_label = np.unique(label)
+def _group_colors(groups):
+    n_users = len(groups.unique['user'])
+    n_labels = len(groups.unique['label'])
+    return [
+        matplotlib.colors.hsv_to_rgb(
+            ((l + 1) / n_labels, (u + 1) / n_users, 0.8))
+        for u, l in zip(groups.code('user'), groups.code('label'))
+    ]
+
+
+def stairs(data, legend=False, groups=None):
+    groups = statistics.Groups(data) if groups is None else groups
     radius = data['intensity'] * data['filter_radius']
 
     fig = plt.figure("Stairs")
     ax = plt.axes()
-    for user_index, user_name in enumerate(unique_user):
-        user_color = (user_index + 1) / len(unique_user)
-        for label_index, label_name in enumerate(unique_label):
-            label_color = (label_index + 1) / len(unique_label)
-            color = matplotlib.colors.hsv_to_rgb(
-                (label_color, user_color, 0.8))
-            ax.plot(radius[(user == user_name) & (label == label_name)],
-                    color=color,
-                    label=label_name)
+    for r, color, label_name in zip(groups.series(radius),
+                                    _group_colors(groups),
+                                    groups.values('label')):
+        ax.plot(r, color=color, label=label_name)
     if legend:
         ax.legend()
 
     return fig
 
 
-def thresholds(data):
-    user = data['user']
-    unique_user = np.unique(data['user'])
-    label = data['label']
-    unique_label = np.unique(label)
+def thresholds(data, groups=None):
+    groups = statistics.Groups(data) if groups is None else groups
+    unique_label = groups.unique['label']
     radius = data['intensity'] * data['filter_radius']
 
     fig = plt.figure("Thresholds")
     ax = plt.axes()
-    for user_index, user_name in enumerate(unique_user):
-        user_color = (user_index + 1) / len(unique_user)
-        for label_index, label_name in enumerate(unique_label):
-            r = radius[(user == user_name) & (label == label_name)]
-            label_color = (label_index + 1) / len(unique_label)
-            color = matplotlib.colors.hsv_to_rgb(
-                (label_color, user_color, 0.8))
-            ax.plot(label_index, r[-1], 'o', color=color)
+    for label_index, r, color in zip(groups.code('label'),
+                                     groups.last(radius),
+                                     _group_colors(groups)):
+        ax.plot(label_index, r, 'o', color=color)
 
     plt.xticks(range(len(unique_label)),
                unique_label,
@@ -65,32 +62,20 @@ def thresholds(data):
     return fig
 
 
-def boxplot(data, show_points=True):
-    user = data['user']
-    unique_user = np.unique(data['user'])
-    label = data['label']
-    unique_label = np.unique(label)
-    radius = data['intensity'] * data['filter_radius']
+def boxplot(data, show_points=True, groups=None):
+    groups = statistics.Groups(data) if groups is None else groups
+    unique_label = groups.unique['label']
+    radius = groups.last(data['intensity'] * data['filter_radius'])
+    label_index = groups.code('label')
 
     fig = plt.figure("Boxplot")
     ax = plt.axes()
 
-    radii = [[
-        radius[(user == user_name) & (label == label_name)]
-        for user_name in unique_user
-    ] for label_name in unique_label]
-    radii = [[r[-1] for r in radius if len(r) > 0] for radius in radii]
+    radii = [radius[label_index == l] for l in range(len(unique_label))]
 
     if show_points:
-        colors = [[
-            matplotlib.colors.hsv_to_rgb(
-                (l / len(unique_label), u / len(unique_user), 0.8))
-            for u in range(1, len(unique_user) + 1)
-        ] for l in range(1, len(unique_label) + 1)]
-
-        for i, (radius, color) in enumerate(zip(radii, colors)):
-            for r, c, in zip(radius, color):
-                ax.plot(i + 1, r, 'o', color=c)
+        for l, r, color in zip(label_index, radius, _group_colors(groups)):
+            ax.plot(l + 1, r, 'o', color=color)
 
     unique_label = relabel(unique_label)
 
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+entry_points = ('study', 'stimuli', 'quest', 'cache', 'csv2np',
+                'evaluation.py --help')
+_line_pattern = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def import_times(entry_point, startup_modules=()):
+    if entry_point.endswith('.py') or '.py ' in entry_point:
+        command = entry_point.split()
+    elif entry_point:
+        command = ['-c', f'import {entry_point}']
+    else:
+        command = ['-c', 'pass']
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + command,
+                             capture_output=True,
+                             text=True,
+                             stdin=subprocess.DEVNULL,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    imports = []
+    error = None
+    for line in process.stderr.splitlines():
+        match = _line_pattern.match(line)
+        if match is None:
+            if not line.startswith('import time:') and line.strip():
+                error = line.strip()
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        if len(indent) == 0 and name in startup_modules:
+            continue
+        imports.append({
+            'name': name,
+            'depth': len(indent) // 2,
+            'self_ms': int(self_us) / 1000.0,
+            'cumulative_ms': int(cumulative_us) / 1000.0
+        })
+    total_ms = sum(i['cumulative_ms'] for i in imports if i['depth'] == 0)
+    return {
+        'entry_point': entry_point,
+        'ok': process.returncode == 0,
+        'error': None if process.returncode == 0 else error,
+        'total_ms': total_ms,
+        'imports': imports
+    }
+
+
+def startup_modules():
+    return {
+        i['name']
+        for i in import_times('')['imports'] if i['depth'] == 0
+    }
+
+
+def print_report(report, n_top):
+    status = 'ok' if report['ok'] else f'FAILED ({report["error"]})'
+    print(f'{report["entry_point"]}: {report["total_ms"]:.1f} ms {status}')
+    # the heaviest imports of the entry point itself
+    entry_module = report['entry_point'].split()[0]
+    imports = [
+        i for i in report['imports']
+        if i['depth'] <= 1 and i['name'] != entry_module
+    ]
+    imports.sort(key=lambda i: i['cumulative_ms'], reverse=True)
+    for i in imports[:n_top]:
+        print(f'  {i["cumulative_ms"]:9.1f} ms  {i["name"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report the import time of the entry points.')
+    parser.add_argument('entry_points', nargs='*', default=entry_points)
+    parser.add_argument('--top',
+                        type=int,
+                        default=5,
+                        help='Number of top level imports to list.')
+    parser.add_argument('--max-ms',
+                        type=float,
+                        help='Fail if an entry point takes longer.')
+    parser.add_argument('--json', help='Write the report into a JSON file.')
+    args = parser.parse_args(sys.argv[1:])
+
+    startup = startup_modules()
+    reports = [import_times(e, startup) for e in args.entry_points]
+    for report in reports:
+        print_report(report, args.top)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(reports, file, indent=2)
+
+    failed = [r for r in reports if not r['ok']]
+    too_slow = [
+        r for r in reports
+        if args.max_ms is not None and r['total_ms'] > args.max_ms
+    ]
+    sys.exit(1 if failed or too_slow else 0)
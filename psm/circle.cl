@@ -124,4 +124,82 @@ float estimate_circle_half_space_overlap(const float circle_x,
         circle_radius, circle_radius2, distance_to_line, circle_area);
 
     return segment_area / circle_area;
-}
\ No newline at end of file
+}
+
+#ifndef CIRCLE_AREA_TABLE_WIDTH
+#define CIRCLE_AREA_TABLE_WIDTH 513
+#endif
+
+#ifndef CIRCLE_AREA_TABLE_HEIGHT
+#define CIRCLE_AREA_TABLE_HEIGHT 257
+#endif
+
+// The circle area table holds estimate_circle_segment_area of the unit circle
+// for the distances x in [0, 1] in its first row, followed by one row of
+// estimate_circle_segment_interval_area(x, y) for every y in [0, 1].
+
+float lookup_circle_table_row(__global const float* row, const float x)
+{
+    const float u = clamp(x, 0.0f, 1.0f) * (CIRCLE_AREA_TABLE_WIDTH - 1);
+    const int i = min((int)u, CIRCLE_AREA_TABLE_WIDTH - 2);
+    return mix(row[i], row[i + 1], u - (float)i);
+}
+
+float lookup_circle_segment_interval_area(__global const float* table,
+                                          const float x,
+                                          const float y)
+{
+    const float v = clamp(y, 0.0f, 1.0f) * (CIRCLE_AREA_TABLE_HEIGHT - 1);
+    const int j = min((int)v, CIRCLE_AREA_TABLE_HEIGHT - 2);
+    __global const float* row = table + (j + 1) * CIRCLE_AREA_TABLE_WIDTH;
+    return mix(lookup_circle_table_row(row, x),
+               lookup_circle_table_row(row + CIRCLE_AREA_TABLE_WIDTH, x),
+               v - (float)j);
+}
+
+float lookup_circle_interval_area(__global const float* table,
+                                  const float x0,
+                                  const float x1,
+                                  const float radius,
+                                  const float radius2)
+{
+    const float inv_radius = 1.0f / radius;
+    float left_area = lookup_circle_table_row(table, fabs(x0) * inv_radius);
+    float right_area = lookup_circle_table_row(table, fabs(x1) * inv_radius);
+
+    const float circle_area = estimate_circle_area2(1.0f);
+
+    if (x0 > 0.0f)
+        left_area = circle_area - left_area;
+    if (x1 <= 0.0f)
+        right_area = circle_area - right_area;
+
+    return (circle_area - left_area - right_area) * radius2;
+}
+
+float lookup_circle_infinite_bar_area(__global const float* table,
+                                      const float x0,
+                                      const float x1,
+                                      const float y,
+                                      const float radius,
+                                      const float radius2)
+{
+    const float inv_radius = 1.0f / radius;
+    const float v = min(y * inv_radius, 1.0f);
+
+    const float segment_area = lookup_circle_table_row(table, v);
+
+    float left_area =
+        lookup_circle_segment_interval_area(table, fabs(x0) * inv_radius, v);
+
+    if (x0 > 0.0f)
+        left_area = segment_area - left_area;
+
+    float right_area =
+        lookup_circle_segment_interval_area(table, fabs(x1) * inv_radius, v);
+
+    if (x1 <= 0.0f)
+        right_area = segment_area - right_area;
+
+    return (segment_area - left_area - right_area) * radius2;
+}
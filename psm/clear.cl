@@ -3,5 +3,7 @@ __kernel void clear(__write_only image2d_t result)
 {
     const size_t col = get_global_id(0);
     const size_t row = get_global_id(1);
+    if (col >= get_image_width(result) || row >= get_image_height(result))
+        return;
     write_imagef(result, (int2)(col, row), (float4)(0.5f, 0.5f, 0.5f, 1.0f));
 }
@@ -0,0 +1,623 @@
+"""NumPy port of the OpenCL kernels in this package.
+
+Every function mirrors the OpenCL function of the same name, but operates on
+whole arrays of pixels at once. All arithmetic is done in float32 like on the
+device, but the device rounds sqrt, sin, cos and contracted multiply-adds its
+own way, so coverages agree only to a few float32 ulps. Without noise the
+rendered images match the OpenCL backend within one 8-bit step per pixel.
+
+The noise comes from the same counter-based Philox generator keyed by the
+seed and the pixel index, so its random bits are identical on both backends.
+The noisy images are not: with filter_radius_noise the per-pixel radius
+carries the ulp differences into the coverage, and a pixel whose coverage
+rounds to exactly 0 or 1 on one backend only gets Poisson noise on the other.
+Such a pixel can differ by up to 255 * filter_noise + 1 steps: 21 steps for
+the study's noise of 20 (stimuli.Generator passes 20 / 255), a full 255 once
+filter_noise reaches 1. On 160x120 images with filter_samples 100 and
+filter_radius_noise 0.1 this hits one or two pixels per image; use the OpenCL
+backend where noisy images must be reproduced exactly.
+"""
+import numpy as np
+
+PHILOX_M = np.uint64(0xD256D193)
+PHILOX_W = np.uint64(0x9E3779B9)
+MASK_32 = np.uint64(0xFFFFFFFF)
+RADIUS_NOISE_STREAM = 0
+POISSON_NOISE_STREAM = 1
+POISSON_INVERSION_LIMIT = np.float32(12)
+POISSON_MAX_COUNT = np.float32(64)
+SAMPLE_PROFILE_SAMPLES = 32
+SAMPLE_PROFILE_STEP = 0.5
+
+
+def _float(value):
+    return np.asarray(value, dtype=np.float32)
+
+
+def philox2x32(counter_lo, counter_hi, key):
+    counter_lo = np.asarray(counter_lo, np.uint64)
+    counter_hi = np.asarray(counter_hi, np.uint64)
+    key = np.uint64(key)
+    for _ in range(10):
+        product = counter_lo * PHILOX_M
+        counter_lo, counter_hi = ((product >> np.uint64(32)) ^ key ^
+                                  counter_hi), product & MASK_32
+        key = (key + PHILOX_W) & MASK_32
+    return counter_lo.astype(np.uint32), counter_hi.astype(np.uint32)
+
+
+def random_bits(seed, pixel, stream):
+    pixel = np.asarray(pixel, np.uint32)
+    return philox2x32(pixel, np.full(pixel.shape, stream, np.uint32),
+                      int(seed) % 2**32)
+
+
+def random_uniform(bits):
+    return ((bits >> np.uint32(8)) | np.uint32(1)).astype(
+        np.float32) * np.float32(2**-24)
+
+
+def standard_normal(bits):
+    return np.sqrt(np.float32(-2) * np.log(random_uniform(bits[0]))) * np.cos(
+        np.float32(2) * np.float32(np.pi) * random_uniform(bits[1]))
+
+
+def random_poisson(u, z, expected):
+    u, z, expected = np.broadcast_arrays(_float(u), _float(z), _float(expected))
+    count = np.zeros(expected.shape, np.float32)
+
+    inversion = expected < POISSON_INVERSION_LIMIT
+    if inversion.any():
+        u = u[inversion]
+        rate = expected[inversion]
+        p = np.exp(-rate)
+        cdf = p.copy()
+        k = np.zeros(rate.shape, np.float32)
+        active = cdf < u
+        while active.any():
+            k[active] += np.float32(1)
+            p[active] *= rate[active] / k[active]
+            cdf[active] += p[active]
+            active &= (cdf < u) & (k < POISSON_MAX_COUNT)
+        count[inversion] = k
+
+    normal = ~inversion
+    rate = expected[normal]
+    count[normal] = np.maximum(rate + np.sqrt(rate) * z[normal],
+                               np.float32(0))
+    return count
+
+
+def poisson_noise(u, z, samples):
+    samples = _float(samples)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        noise = random_poisson(u, z, samples) / samples - np.float32(1)
+    return np.where(samples > 0, np.clip(noise, -1, 1), 0).astype(np.float32)
+
+
+def pixel_radius_noise(seed, pixel, noise_field=None):
+    if noise_field is not None:
+        return noise_field[pixel, 0]
+    return random_uniform(random_bits(seed, pixel, RADIUS_NOISE_STREAM)[0])
+
+
+def pixel_poisson_noise(seed, pixel, samples, noise_field=None):
+    samples = _float(samples)
+    if noise_field is not None:
+        return poisson_noise(noise_field[pixel, 1], noise_field[pixel, 2],
+                             samples)
+    bits = random_bits(seed, pixel, POISSON_NOISE_STREAM)
+    z = np.zeros(samples.shape, np.float32)
+    normal = samples >= POISSON_INVERSION_LIMIT
+    z[normal] = standard_normal((bits[0][normal], bits[1][normal]))
+    return poisson_noise(random_uniform(bits[0]), z, samples)
+
+
+def fill_noise_field(width, height, seed):
+    pixel = np.arange(width * height, dtype=np.uint32)
+    bits = random_bits(seed, pixel, POISSON_NOISE_STREAM)
+    field = np.zeros((width * height, 4), np.float32)
+    field[:, 0] = pixel_radius_noise(seed, pixel)
+    field[:, 1] = random_uniform(bits[0])
+    field[:, 2] = standard_normal(bits)
+    return field
+
+
+def rotate_point(rotation_center_x, rotation_center_y, rotation_angle, x, y):
+    angle_sin = np.sin(_float(rotation_angle))
+    angle_cos = np.cos(_float(rotation_angle))
+    tmp_x = x - _float(rotation_center_x)
+    tmp_y = y - _float(rotation_center_y)
+    return (angle_cos * tmp_x - angle_sin * tmp_y + rotation_center_x,
+            angle_sin * tmp_x + angle_cos * tmp_y + rotation_center_y)
+
+
+def rasterize(raster_size, value):
+    result = np.floor(value / raster_size) * raster_size
+    return np.where(result <= value, result, result - raster_size)
+
+
+def rasterize_line_y(artifact_size, k, d, x):
+    y = k * x + d
+    rasterized_y = rasterize(artifact_size, y)
+    return np.where(y - rasterized_y < artifact_size * 0.5, rasterized_y,
+                    rasterized_y + artifact_size)
+
+
+def estimate_circle_area2(radius2):
+    return np.float32(19.0 / 6.0) * radius2
+
+
+def estimate_circle_segment_area(segment_height, chord_length):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_chord_length = 1.0 / (2.0 * chord_length)
+        area = segment_height * (np.float32(2.0 / 3.0) * chord_length +
+                                 segment_height * segment_height *
+                                 inv_chord_length)
+    return np.where(np.isfinite(inv_chord_length), area, np.float32(0))
+
+
+def estimate_circle_segment_interval_area(x, y, max_x, radius, radius2):
+    x = np.fmin(x, max_x)
+    with np.errstate(invalid='ignore'):
+        circle_y = np.sqrt(radius2 - x * x)
+
+    x_segment_area = estimate_circle_segment_area(radius - x, 2.0 * circle_y)
+    max_x_segment_area = estimate_circle_segment_area(radius - max_x, 2.0 * y)
+    rect_area = (max_x - x) * y
+    return np.fmax((x_segment_area - max_x_segment_area) / 2.0 - rect_area,
+                   np.float32(0))
+
+
+def estimate_circle_interval_area(x0, x1, radius, radius2):
+    with np.errstate(invalid='ignore'):
+        valid_x0 = np.fmin(np.abs(x0), radius)
+        left_area = estimate_circle_segment_area(
+            radius - valid_x0, 2.0 * np.sqrt(radius2 - valid_x0 * valid_x0))
+
+        valid_x1 = np.fmin(np.abs(x1), radius)
+        right_area = estimate_circle_segment_area(
+            radius - valid_x1, 2.0 * np.sqrt(radius2 - valid_x1 * valid_x1))
+
+    circle_area = estimate_circle_area2(radius2)
+
+    left_area = np.where(x0 > 0.0, circle_area - left_area, left_area)
+    right_area = np.where(x1 <= 0.0, circle_area - right_area, right_area)
+
+    return circle_area - left_area - right_area
+
+
+def estimate_circle_infinite_bar_area(x0, x1, y, radius, radius2):
+    y = np.fmin(y, radius)
+    with np.errstate(invalid='ignore'):
+        max_x = np.sqrt(radius2 - y * y)
+
+    segment_area = estimate_circle_segment_area(radius - y, 2.0 * max_x)
+
+    left_area = estimate_circle_segment_interval_area(np.abs(x0), y, max_x,
+                                                      radius, radius2)
+    left_area = np.where(x0 > 0.0, segment_area - left_area, left_area)
+
+    right_area = estimate_circle_segment_interval_area(
+        np.abs(x1), y, max_x, radius, radius2)
+    right_area = np.where(x1 <= 0.0, segment_area - right_area, right_area)
+
+    return segment_area - left_area - right_area
+
+
+def estimate_circle_segment_percentage(radius, radius2, distance,
+                                       circle_area):
+    segment_height = radius - np.abs(distance)
+    with np.errstate(invalid='ignore'):
+        chord_length = 2.0 * np.sqrt(radius2 - distance * distance)
+    segment_area = estimate_circle_segment_area(segment_height, chord_length)
+
+    area = np.where(distance > 0, circle_area - segment_area, segment_area)
+    area = np.where(distance < -radius, np.float32(0), area)
+    return np.where(distance > radius, circle_area, area)
+
+
+def estimate_circle_half_space_overlap(circle_x, circle_y, circle_radius,
+                                       line_x, line_y, line_angle):
+    line_angle = _float(line_angle)
+    distance_to_line = (np.cos(line_angle) * (line_y - circle_y) -
+                        np.sin(line_angle) * (line_x - circle_x))
+
+    circle_radius = _float(circle_radius)
+    if circle_radius <= 0.0:
+        return np.where(distance_to_line >= circle_radius, np.float32(1),
+                        np.float32(0))
+
+    circle_radius2 = circle_radius * circle_radius
+    circle_area = estimate_circle_area2(circle_radius2)
+    segment_area = estimate_circle_segment_percentage(
+        circle_radius, circle_radius2, distance_to_line, circle_area)
+
+    return segment_area / circle_area
+
+
+def lookup_circle_table_row(row, x):
+    width = row.shape[-1]
+    u = np.clip(x, 0.0, 1.0) * np.float32(width - 1)
+    i = np.minimum(u.astype(np.int32), width - 2)
+    t = u - i
+    return row[..., i] * (1.0 - t) + row[..., i + 1] * t
+
+
+def lookup_circle_segment_interval_area(table, x, y):
+    height = table.shape[0] - 1
+    v = np.clip(y, 0.0, 1.0) * np.float32(height - 1)
+    j = np.minimum(v.astype(np.int32), height - 2)
+    t = v - j
+    width = table.shape[1]
+    u = np.clip(x, 0.0, 1.0) * np.float32(width - 1)
+    i = np.minimum(u.astype(np.int32), width - 2)
+    s = u - i
+    rows = table[1:]
+    lower = rows[j, i] * (1.0 - s) + rows[j, i + 1] * s
+    upper = rows[j + 1, i] * (1.0 - s) + rows[j + 1, i + 1] * s
+    return lower * (1.0 - t) + upper * t
+
+
+def lookup_circle_interval_area(table, x0, x1, radius, radius2):
+    inv_radius = 1.0 / radius
+    left_area = lookup_circle_table_row(table[0], np.abs(x0) * inv_radius)
+    right_area = lookup_circle_table_row(table[0], np.abs(x1) * inv_radius)
+
+    circle_area = estimate_circle_area2(np.float32(1))
+
+    left_area = np.where(x0 > 0.0, circle_area - left_area, left_area)
+    right_area = np.where(x1 <= 0.0, circle_area - right_area, right_area)
+
+    return (circle_area - left_area - right_area) * radius2
+
+
+def lookup_circle_infinite_bar_area(table, x0, x1, y, radius, radius2):
+    inv_radius = 1.0 / radius
+    v = np.fmin(y * inv_radius, np.float32(1))
+
+    segment_area = lookup_circle_table_row(table[0], v)
+
+    left_area = lookup_circle_segment_interval_area(table,
+                                                    np.abs(x0) * inv_radius, v)
+    left_area = np.where(x0 > 0.0, segment_area - left_area, left_area)
+
+    right_area = lookup_circle_segment_interval_area(
+        table, np.abs(x1) * inv_radius, v)
+    right_area = np.where(x1 <= 0.0, segment_area - right_area, right_area)
+
+    return (segment_area - left_area - right_area) * radius2
+
+
+def filter_line(line_x,
+                line_y,
+                line_angle,
+                artifact_size,
+                filter_x,
+                filter_y,
+                filter_radius,
+                circle_area_table=None):
+    artifact_size = np.float32(artifact_size)
+    filter_radius = np.broadcast_to(_float(filter_radius), filter_x.shape)
+    line_angle = _float(line_angle)
+
+    max_r = filter_radius + artifact_size
+    line_nx = -np.sin(line_angle)
+    line_ny = np.cos(line_angle)
+    line_d = line_x * line_nx + line_y * line_ny
+    filter_d = filter_x * line_nx + filter_y * line_ny
+
+    color = np.zeros(filter_x.shape, np.float32)
+    is_outside = filter_d - max_r > line_d
+    is_inside = ~is_outside & (filter_d + max_r < line_d)
+    color[is_inside] = 1.0
+    band = ~is_outside & ~is_inside
+    if not band.any():
+        return color
+
+    filter_x = filter_x[band]
+    filter_y = filter_y[band]
+    filter_radius = filter_radius[band]
+
+    k = -line_nx / line_ny
+    d = line_y - k * line_x
+    pixel_center_shift = filter_x + artifact_size * 0.5
+
+    c0 = rasterize(artifact_size, filter_x - filter_radius) - filter_x
+    filter_radius2 = filter_radius * filter_radius
+
+    r1 = rasterize_line_y(artifact_size, k, d,
+                          c0 + pixel_center_shift) - filter_y
+    point_color = np.where(r1 < 0.0, np.float32(0), np.float32(1))
+
+    area = np.zeros(filter_x.shape, np.float32)
+    active = (filter_radius > 0.0) & (c0 <= filter_radius)
+    while active.any():
+        c1 = c0 + artifact_size
+        r1 = rasterize_line_y(artifact_size, k, d,
+                              c0 + pixel_center_shift) - filter_y
+        if circle_area_table is None:
+            a = estimate_circle_infinite_bar_area(c0, c1, np.abs(r1),
+                                                  filter_radius,
+                                                  filter_radius2)
+            interval_area = estimate_circle_interval_area(
+                c0, c1, filter_radius, filter_radius2)
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                a = lookup_circle_infinite_bar_area(circle_area_table, c0, c1,
+                                                    np.abs(r1), filter_radius,
+                                                    filter_radius2)
+                interval_area = lookup_circle_interval_area(
+                    circle_area_table, c0, c1, filter_radius, filter_radius2)
+        a = np.where(r1 > 0, interval_area - a, a)
+        area += np.where(active, a, np.float32(0))
+        c0 = c1
+        active &= c0 <= filter_radius
+
+    circle_area = estimate_circle_area2(filter_radius2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        area = np.fmin(np.fmax(area / circle_area, np.float32(0)),
+                       np.float32(1))
+    color[band] = np.where(filter_radius <= 0.0, point_color, area)
+    return color
+
+
+def sample_profile_supported(line_angle, image_samples):
+    # the profile is valid while every rotated sample line keeps cos > 0, i.e.
+    # line_angle + 40 deg / i in (-pi/2, pi/2), which for line_angle means
+    # (-pi/2, 5 pi/18) or about (-1.571, 0.873) rad. Past pi/2 the brute-force
+    # coverage jumps at |s| = radius + artifact_size and the 0.5 px
+    # interpolation of the profile smears that jump by over 100 steps.
+    rotations = np.deg2rad(40.0 / np.arange(1, max(image_samples, 1)))
+    return bool(np.all(np.cos(line_angle + rotations) > 0.0))
+
+
+def sample_profile_size(artifact_size, filter_radius, filter_radius_noise):
+    max_distance = (filter_radius * (1.0 + filter_radius_noise / 2.0) +
+                    artifact_size + 1.0)
+    n_s = int(np.ceil(2.0 * max_distance / SAMPLE_PROFILE_STEP)) + 1
+    n_radii = 5 if filter_radius_noise > 0.0 else 1
+    return -max_distance, SAMPLE_PROFILE_STEP, n_s, n_radii
+
+
+def sample_profile(artifact_size, line_x, line_y, line_angle, filter_radius,
+                   filter_radius_noise, image_samples, circle_area_table=None):
+    min_s, step_s, n_s, n_radii = sample_profile_size(artifact_size,
+                                                      filter_radius,
+                                                      filter_radius_noise)
+    min_radius = filter_radius * (1.0 - filter_radius_noise / 2.0)
+    step_radius = (filter_radius * filter_radius_noise /
+                   (n_radii - 1) if n_radii > 1 else 0.0)
+
+    s = _float(min_s + step_s * np.arange(n_s))[None, :, None]
+    radius = _float(min_radius +
+                    step_radius * np.arange(n_radii))[:, None, None]
+    span = 2.0 * (radius + np.float32(artifact_size))
+    t = ((np.arange(SAMPLE_PROFILE_SAMPLES, dtype=np.float32) + 0.5) /
+         SAMPLE_PROFILE_SAMPLES - 0.5)[None, None, :] * span
+    shape = (n_radii, n_s, SAMPLE_PROFILE_SAMPLES)
+
+    color = np.zeros(shape, np.float32)
+    for i in range(1, image_samples):
+        angle = np.float32(line_angle) + np.float32((40.0 / i) * np.pi / 180.0)
+        line_nx = -np.sin(angle)
+        line_ny = np.cos(angle)
+        color += filter_line(line_x, line_y, angle, artifact_size,
+                             np.broadcast_to(line_x + s * line_nx + t * line_ny,
+                                             shape),
+                             np.broadcast_to(line_y + s * line_ny - t * line_nx,
+                                             shape),
+                             np.broadcast_to(radius, shape), circle_area_table)
+
+    header = [min_s, step_s, n_s, n_radii, min_radius, step_radius]
+    return np.concatenate([header, color.mean(axis=-1).ravel()]).astype(
+        np.float32)
+
+
+def lookup_sample_profile(sample_profile, s, radius):
+    min_s, step_s, n_s, n_radii, min_radius, step_radius = sample_profile[:6]
+    n_s = int(n_s)
+    n_radii = int(n_radii)
+    rows = sample_profile[6:].reshape(n_radii, n_s)
+
+    u = np.clip((s - min_s) / step_s, 0.0, n_s - 1.0)
+    i = np.minimum(u.astype(np.int32), n_s - 2)
+    t = u - i
+    if n_radii == 1:
+        return rows[0, i] * (1.0 - t) + rows[0, i + 1] * t
+
+    v = np.clip((radius - min_radius) / step_radius, 0.0, n_radii - 1.0)
+    j = np.minimum(v.astype(np.int32), n_radii - 2)
+    w = v - j
+    lower = rows[j, i] * (1.0 - t) + rows[j, i + 1] * t
+    upper = rows[j + 1, i] * (1.0 - t) + rows[j + 1, i + 1] * t
+    return lower * (1.0 - w) + upper * w
+
+
+def write_image(result, color):
+    value = np.rint(np.clip(color, 0.0, 1.0) * 255.0).astype(np.uint8)
+    result[:, :, 0] = value
+    result[:, :, 1] = value
+    result[:, :, 2] = value
+    result[:, :, 3] = 255
+
+
+def clear(result):
+    result[:, :, :3] = 128
+    result[:, :, 3] = 255
+
+
+def pixel_grid(width, height):
+    row, col = np.indices((height, width), dtype=np.float32)
+    return col, row
+
+
+def pixel_index(width, height):
+    return np.arange(width * height, dtype=np.uint32).reshape(height, width)
+
+
+def filtered_line(width, height, line_x, line_y, line_angle, filter_radius,
+                  filter_noise, filter_samples, image_angle, result, seed=0,
+                  noise_field=None):
+    col, row = pixel_grid(width, height)
+    cx = np.float32(width * 0.5)
+    cy = np.float32(height * 0.5)
+
+    filter_x, filter_y = rotate_point(cx, cy, image_angle, col, row)
+
+    color = estimate_circle_half_space_overlap(filter_x, filter_y,
+                                               filter_radius, line_x, line_y,
+                                               line_angle)
+
+    in_penumbra = (0.0 < color) & (color < 1.0)
+    if filter_noise > 0.0 and in_penumbra.any():
+        color[in_penumbra] += np.float32(filter_noise) * pixel_poisson_noise(
+            seed, pixel_index(width, height)[in_penumbra],
+            np.float32(filter_samples) * color[in_penumbra], noise_field)
+
+    write_image(result, color)
+    return result
+
+
+def filtered_line_artifact(width,
+                           height,
+                           artifact_size,
+                           line_x,
+                           line_y,
+                           line_angle,
+                           filter_radius,
+                           filter_noise,
+                           filter_samples,
+                           filter_radius_noise,
+                           image_angle,
+                           image_samples,
+                           result,
+                           circle_area_table=None,
+                           use_sample_profile=False,
+                           seed=0,
+                           noise_field=None):
+    col, row = pixel_grid(width, height)
+    cx = np.float32(width * 0.5)
+    cy = np.float32(height * 0.5)
+    line_x = np.float32(line_x)
+    line_y = np.float32(line_y)
+
+    radius = np.float32(filter_radius)
+    if filter_radius_noise > 0.0:
+        filter_radius_noise = np.float32(filter_radius_noise)
+        noise = pixel_radius_noise(seed, pixel_index(width, height),
+                                   noise_field)
+        radius = radius * (filter_radius_noise * noise +
+                           (1.0 - filter_radius_noise / 2))
+
+    filter_x, filter_y = rotate_point(cx, cy, image_angle, col, row)
+
+    color = filter_line(line_x, line_y, line_angle, artifact_size, filter_x,
+                        filter_y, radius, circle_area_table)
+    in_penumbra = (0.0 < color) & (color < 1.0)
+
+    if (use_sample_profile and image_samples > 1 and
+            sample_profile_supported(line_angle, image_samples)):
+        profile = sample_profile(artifact_size, line_x, line_y, line_angle,
+                                 filter_radius, filter_radius_noise,
+                                 image_samples, circle_area_table)
+        line_nx = -np.sin(np.float32(line_angle))
+        line_ny = np.cos(np.float32(line_angle))
+        s = (filter_x - line_x) * line_nx + (filter_y - line_y) * line_ny
+        color += lookup_sample_profile(profile, s, radius)
+        image_samples_loop = 1
+    else:
+        image_samples_loop = image_samples
+
+    for i in range(1, image_samples_loop):
+        rotation = np.float32((40.0 / i) * np.pi / 180.0)
+        sample_x, sample_y = rotate_point(line_x, line_y, rotation, filter_x,
+                                          filter_y)
+        color += filter_line(line_x, line_y,
+                             np.float32(line_angle) + rotation,
+                             artifact_size, sample_x, sample_y, radius,
+                             circle_area_table)
+    color /= np.float32(image_samples)
+
+    if filter_noise > 0.0 and in_penumbra.any():
+        color[in_penumbra] += np.float32(filter_noise) * pixel_poisson_noise(
+            seed, pixel_index(width, height)[in_penumbra],
+            np.float32(filter_samples) * color[in_penumbra], noise_field)
+
+    write_image(result, color)
+    return result
+
+
+def circle_area_table(width, height):
+    x = np.linspace(0.0, 1.0, width)
+    y = np.linspace(0.0, 1.0, height)[:, None]
+    segment_area = estimate_circle_segment_area(1.0 - x,
+                                                2.0 * np.sqrt(1.0 - x * x))
+    max_x = np.sqrt(1.0 - y * y)
+    interval_area = estimate_circle_segment_interval_area(
+        x, y, max_x, 1.0, 1.0)
+    return np.concatenate([segment_area[None], interval_area]).astype(
+        np.float32)
+
+
+def circle_area_table_error(table, n_samples=100000, seed=0):
+    # largest error of one column seen on random samples, relative to the
+    # circle area; an estimate, the worst case may lie between the samples
+    random = np.random.RandomState(seed)
+    x0 = random.uniform(-1.2, 1.2, n_samples).astype(np.float32)
+    x1 = x0 + random.uniform(0.0, 0.5, n_samples).astype(np.float32)
+    y = random.uniform(0.0, 1.2, n_samples).astype(np.float32)
+    one = np.float32(1)
+
+    bar_error = np.abs(
+        estimate_circle_infinite_bar_area(x0, x1, y, one, one) -
+        lookup_circle_infinite_bar_area(table, x0, x1, y, one, one))
+    interval_error = np.abs(
+        estimate_circle_interval_area(x0, x1, one, one) -
+        lookup_circle_interval_area(table, x0, x1, one, one))
+    return float(np.max(bar_error + interval_error) / estimate_circle_area2(one))
+
+
+def line_staircase(line_x, line_y, line_angle, artifact_size, min_x, max_x):
+    artifact_size = np.float32(artifact_size)
+    line_angle = _float(line_angle)
+    line_nx = -np.sin(line_angle)
+    line_ny = np.cos(line_angle)
+    k = -line_nx / line_ny
+    d = np.float32(line_y) - k * np.float32(line_x)
+
+    first_x = rasterize(artifact_size, _float(min_x))
+    n_columns = int(np.ceil((max_x - first_x) / artifact_size)) + 1
+    x = first_x + artifact_size * np.arange(n_columns, dtype=np.float32)
+    y = rasterize_line_y(artifact_size, k, d, x + artifact_size * 0.5)
+
+    is_step = np.ones(n_columns, bool)
+    is_step[1:] = y[1:] != y[:-1]
+    steps = np.stack([x[is_step], y[is_step]], axis=-1)
+    end = [[x[-1] + artifact_size, y[-1]]]
+    return np.concatenate([steps, end]).astype(np.float32)
+
+
+def line_staircases(width, height, line_x, line_y, line_angle, artifact_size,
+                    max_filter_radius, image_angle, image_samples):
+    corners_x = _float([0, width - 1, 0, width - 1])
+    corners_y = _float([0, 0, height - 1, height - 1])
+    filter_x, filter_y = rotate_point(np.float32(width * 0.5),
+                                      np.float32(height * 0.5), image_angle,
+                                      corners_x, corners_y)
+    margin = max_filter_radius + 2 * artifact_size
+
+    staircases = []
+    for i in range(image_samples):
+        rotation = np.float32((40.0 / i) * np.pi / 180.0) if i > 0 else 0.0
+        sample_x, _ = rotate_point(line_x, line_y, rotation, filter_x,
+                                   filter_y)
+        staircases.append(
+            line_staircase(line_x, line_y,
+                           np.float32(line_angle) + np.float32(rotation),
+                           artifact_size,
+                           sample_x.min() - margin,
+                           sample_x.max() + margin))
+
+    offsets = np.cumsum([0] + [len(s) for s in staircases]).astype(np.uint32)
+    return np.concatenate(staircases), offsets
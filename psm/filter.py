@@ -1,18 +1,31 @@
+import hashlib
 import os
+import pickle
 import random
+import re
 import numpy as np
 import pyopencl as cl
 from pyopencl.tools import get_gl_sharing_context_properties
+from . import cpu
 
 context = None
 command_queue = None
+copy_queue = None
+profiling_enabled = False
 mem = cl.mem_flags
+backends = ('opencl', 'numpy')
+circle_area_table_size = (513, 257)
+program_cache_dir = os.environ.get(
+    'PSM_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'psm'))
+_programs = {}
+_include_pattern = re.compile(r'^\s*#include\s+"([^"]+)"', re.MULTILINE)
 
 
-def init_opencl(sharing=True):
-    global context, command_queue
+def init_opencl(sharing=True, profiling=False):
+    global context, command_queue, copy_queue, profiling_enabled
     if context is not None:
         return
+    profiling_enabled = profiling
     platform = cl.get_platforms()[-1]
     devices = platform.get_devices()
     if sharing:
@@ -22,64 +35,499 @@ def init_opencl(sharing=True):
             get_gl_sharing_context_properties())
     else:
         context = cl.Context(devices=devices)
-    command_queue = cl.CommandQueue(context)
+    properties = (cl.command_queue_properties.PROFILING_ENABLE
+                  if profiling else 0)
+    command_queue = cl.CommandQueue(context, properties=properties)
+    copy_queue = cl.CommandQueue(context, properties=properties)
 
 
-class Clear:
-    def __init__(self):
-        init_opencl(True)
+def event_time(event):
+    # seconds between start and end, needs a queue with profiling enabled
+    return (event.profile.end - event.profile.start) * 1e-9
+
+
+def event_times(events):
+    # seconds per event name, None until all events are complete
+    if not profiling_enabled:
+        return None
+    times = {}
+    for name, event in events:
+        if (event.command_execution_status !=
+                cl.command_execution_status.COMPLETE):
+            return None
+        times[name] = times.get(name, 0.0) + event_time(event)
+    return times
+
+
+def read_sources(opencl_file, sources=None):
+    if sources is None:
+        sources = {}
+    with open(opencl_file, 'r') as f:
+        source = f.read()
+    sources[opencl_file] = source
+    for include in _include_pattern.findall(source):
+        include_file = os.path.join(os.path.dirname(opencl_file), include)
+        if include_file not in sources and os.path.exists(include_file):
+            read_sources(include_file, sources)
+    return sources
+
+
+def program_key(sources, options):
+    key = hashlib.sha256()
+    for filename, source in sorted(sources.items()):
+        key.update(os.path.basename(filename).encode())
+        key.update(source.encode())
+    for option in options:
+        key.update(option.encode())
+    for device in context.devices:
+        key.update(device.platform.version.encode())
+        key.update(device.name.encode())
+        key.update(device.driver_version.encode())
+    return key.hexdigest()
+
+
+def renderer_version(backend='opencl'):
+    # changes with every kernel source (or the numpy port for that backend)
+    directory = os.path.dirname(__file__)
+    files = sorted(f for f in os.listdir(directory) if f.endswith('.cl'))
+    if backend == 'numpy':
+        files.append('cpu.py')
+    key = hashlib.sha256(backend.encode())
+    for filename in files:
+        with open(os.path.join(directory, filename), 'rb') as file:
+            key.update(filename.encode())
+            key.update(file.read())
+    return key.hexdigest()[:16]
+
+
+def _program_cache_file(key):
+    if not program_cache_dir:
+        return None
+    return os.path.join(program_cache_dir, f'{key}.pickle')
+
+
+def _load_program_binaries(key, options):
+    filename = _program_cache_file(key)
+    if filename is None or not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'rb') as file_handle:
+            binaries = pickle.load(file_handle)
+        return cl.Program(context, context.devices,
+                          binaries).build(options=options)
+    except (OSError, pickle.UnpicklingError, EOFError, cl.Error):
+        return None
+
+
+def _save_program_binaries(key, program):
+    filename = _program_cache_file(key)
+    if filename is None:
+        return
+    try:
+        os.makedirs(program_cache_dir, exist_ok=True)
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'wb') as file_handle:
+            pickle.dump(program.binaries,
+                        file_handle,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+    except (OSError, cl.Error):
+        pass
+
+
+def build_program(opencl_file, defines=None):
+    options = ['-I', f'"{os.path.dirname(opencl_file)}"']
+    for name, value in (defines or {}).items():
+        options += ['-D', f'{name}={value}']
+    sources = read_sources(opencl_file)
+    key = program_key(sources, options)
+    if key in _programs:
+        return _programs[key]
+
+    program = _load_program_binaries(key, options)
+    if program is None:
+        program = cl.Program(context,
+                             sources[opencl_file]).build(options=options)
+        _save_program_binaries(key, program)
+
+    _programs[key] = program
+    return program
+
+
+def work_group_size(kernel, dimensions=2, local_size=None):
+    if local_size is not None:
+        return tuple(local_size) + (1, ) * (dimensions - len(local_size))
+    device = context.devices[0]
+    max_size = min(
+        256,
+        kernel.get_work_group_info(cl.kernel_work_group_info.WORK_GROUP_SIZE,
+                                   device))
+    multiple = kernel.get_work_group_info(
+        cl.kernel_work_group_info.PREFERRED_WORK_GROUP_SIZE_MULTIPLE, device)
+    max_items = device.max_work_item_sizes
+    cols = max(1, min(multiple, max_items[0], max_size))
+    rows = max(1, min(max_size // cols, max_items[1], cols))
+    return (cols, rows) + (1, ) * (dimensions - 2)
+
+
+def padded_size(shape, local_size):
+    return tuple(-(-s // l) * l for s, l in zip(shape, local_size))
+
 
-        opencl_file = os.path.join(os.path.dirname(__file__), 'clear.cl')
+def line_band_regions(width, height, line_angle, image_angle, distances,
+                      half_width, strip=64):
+    # (x, y, width, height) strips of the image that cover every pixel within
+    # half_width of the lines with the given normal distances (and all lines
+    # between them), like the kernels the pixels are rotated by image_angle
+    nx, ny = -np.sin(line_angle), np.cos(line_angle)
+    sin, cos = np.sin(image_angle), np.cos(image_angle)
+    cx, cy = width * 0.5, height * 0.5
+    # the normal distance of pixel (col, row) is a * col + b * row + offset
+    a = nx * cos + ny * sin
+    b = ny * cos - nx * sin
+    offset = nx * (cx - cos * cx + sin * cy) + ny * (cy - sin * cx - cos * cy)
+    low = min(distances) - half_width - offset
+    high = max(distances) + half_width - offset
 
-        with open(opencl_file, 'r') as f:
-            source = f.read()
+    # strips along the axis the band is closer to
+    transposed = abs(a) > abs(b)
+    if transposed:
+        a, b, width, height = b, a, height, width
+    regions = []
+    for start in range(0, width, strip):
+        stop = min(start + strip, width) - 1
+        bounds = [(d - a * x) / b for d in (low, high) for x in (start, stop)]
+        first = max(0, int(np.floor(min(bounds))))
+        last = min(height - 1, int(np.ceil(max(bounds))))
+        if first > last:
+            continue
+        region = (start, first, stop - start + 1, last - first + 1)
+        regions.append((region[1], region[0], region[3],
+                        region[2]) if transposed else region)
+    return regions
 
-        self._program = cl.Program(
-            context,
-            source).build(options=['-I', f'"{os.path.dirname(opencl_file)}"'])
+
+def check_backend(backend, gl_image=None):
+    if backend not in backends:
+        raise ValueError(f'Unknown backend "{backend}", use one of {backends}.')
+    if backend == 'numpy' and gl_image is not None:
+        raise ValueError('The numpy backend does not support GL textures.')
+
+
+class Future:
+    def __init__(self, event, result):
+        self._event = event
+        self._result = result
+
+    @property
+    def event(self):
+        return self._event
+
+    def done(self):
+        return self._event is None or (
+            self._event.command_execution_status ==
+            cl.command_execution_status.COMPLETE)
+
+    def result(self):
+        if self._event is not None:
+            self._event.wait()
+        return self._result
+
+
+class Clear:
+    def __init__(self, backend='opencl', local_size=None, sharing=True):
+        check_backend(backend)
+        self._backend = backend
+        self._local_size = local_size
+        if backend == 'numpy':
+            return
+
+        init_opencl(sharing)
+
+        self._program = build_program(
+            os.path.join(os.path.dirname(__file__), 'clear.cl'))
+        self._kernel = cl.Kernel(self._program, 'clear')
 
     def __call__(self, image):
-        cl.enqueue_acquire_gl_objects(command_queue, [image])
-        self._program.clear(command_queue, image.shape, (1, 1), image)
-        cl.enqueue_release_gl_objects(command_queue, [image])
+        if self._backend == 'numpy':
+            cpu.clear(image)
+            return
+        kernel = self._kernel
+        local_size = work_group_size(kernel, local_size=self._local_size)
+        is_gl_texture = hasattr(image, 'gl_object')
+        if is_gl_texture:
+            cl.enqueue_acquire_gl_objects(command_queue, [image])
+        kernel(command_queue, padded_size(image.shape, local_size), local_size,
+               image)
+        if is_gl_texture:
+            cl.enqueue_release_gl_objects(command_queue, [image])
 
 
 class Base:
-    def __init__(self, image_width, image_height, opencl_file, gl_image=None):
+    def __init__(self,
+                 image_width,
+                 image_height,
+                 opencl_file,
+                 gl_image=None,
+                 backend='opencl',
+                 local_size=None,
+                 n_buffers=1,
+                 noise_field=False):
+        check_backend(backend, gl_image)
+        if gl_image is not None and n_buffers != 1:
+            raise ValueError('GL textures can not be multi-buffered.')
+        self._backend = backend
+        self._image_width = image_width
+        self._image_height = image_height
+        self._local_size = local_size
+        self._work_group_sizes = {}
+        self._kernels = {}
+        self._image_index = 0
+        self._events = []
+        self.use_noise_field = noise_field
+        self._noise_field_buffer = None
+        self._noise_field_seed = None
+        if backend == 'numpy':
+            self._program = None
+            self._result_images = [
+                np.zeros((image_height, image_width, 4), np.uint8)
+            ]
+            return
+
         enable_gl_sharing = gl_image is not None
         init_opencl(enable_gl_sharing)
 
-        with open(opencl_file, 'r') as f:
-            source = f.read()
-
-        self._program = cl.Program(
-            context,
-            source).build(options=['-I', f'"{os.path.dirname(opencl_file)}"'])
+        self._program = build_program(
+            opencl_file, {
+                'CIRCLE_AREA_TABLE_WIDTH': circle_area_table_size[0],
+                'CIRCLE_AREA_TABLE_HEIGHT': circle_area_table_size[1]
+            })
 
         if gl_image is None:
-            shape = (image_height, image_width)
+            shape = (image_width, image_height)
             fmt = cl.ImageFormat(cl.channel_order.RGBA, cl.channel_type.UNORM_INT8)
-            self._result_image = cl.Image(context, mem.WRITE_ONLY, fmt, shape)
+            self._result_images = [
+                cl.Image(context, mem.WRITE_ONLY, fmt, shape)
+                for _ in range(max(1, n_buffers))
+            ]
         else:
             from OpenGL.GL import GL_TEXTURE_2D
-            self._result_image = cl.GLTexture(context,
-                                              mem.WRITE_ONLY,
-                                              GL_TEXTURE_2D,
-                                              0,
-                                              gl_image,
-                                              dims=2)
+            self._result_images = [
+                cl.GLTexture(context,
+                             mem.WRITE_ONLY,
+                             GL_TEXTURE_2D,
+                             0,
+                             gl_image,
+                             dims=2)
+            ]
+        self._copy_events = [None] * len(self._result_images)
 
     @property
     def cl_image(self):
         return self._result_image
 
+    @property
+    def _result_image(self):
+        return self._result_images[self._image_index]
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def shape(self):
+        return (self._image_width, self._image_height)
+
+    def _launch(self, kernel_name, shape, *args, wait_for=None, offset=None):
+        # one kernel per name and instance, the programs are shared
+        if kernel_name not in self._kernels:
+            self._kernels[kernel_name] = cl.Kernel(self._program, kernel_name)
+        kernel = self._kernels[kernel_name]
+        if kernel_name not in self._work_group_sizes:
+            self._work_group_sizes[kernel_name] = work_group_size(
+                kernel, len(shape), self._local_size)
+        local_size = self._work_group_sizes[kernel_name]
+        event = kernel(command_queue,
+                       padded_size(shape, local_size),
+                       local_size,
+                       *args,
+                       global_offset=offset,
+                       wait_for=wait_for)
+        self._events.append((kernel_name, event))
+        return event
+
+    def _launch_regions(self, kernel_name, regions, *args, wait_for=None):
+        # regions are (x, y, width, height) rectangles, None is the whole
+        # image, pixels outside of them keep the color of the last call that
+        # rendered into the same result image (n_buffers calls ago)
+        if regions is None:
+            return self._launch(kernel_name,
+                                self.shape,
+                                *args,
+                                wait_for=wait_for)
+        event = None
+        for x, y, width, height in regions:
+            event = self._launch(kernel_name, (width, height),
+                                 *args,
+                                 wait_for=wait_for,
+                                 offset=(x, y))
+        if event is None:
+            event = cl.enqueue_marker(command_queue, wait_for=wait_for or None)
+        return event
+
+    @property
+    def events(self):
+        # (kernel name or 'copy', event) of the last call
+        return list(self._events)
+
+    def update_noise_field(self, seed):
+        # per-pixel noise quantiles, generated once per seed and kept on the
+        # device for all following frames
+        if not self.use_noise_field:
+            return None
+        if seed == self._noise_field_seed:
+            return self._noise_field_buffer
+        width, height = self._image_width, self._image_height
+        if self._backend == 'numpy':
+            self._noise_field_buffer = cpu.fill_noise_field(
+                width, height, seed)
+        else:
+            if self._noise_field_buffer is None:
+                self._noise_field_buffer = cl.Buffer(context, mem.READ_WRITE,
+                                                     16 * width * height)
+            self._launch('fill_noise_field', self.shape, np.uint32(width),
+                         np.uint32(height), np.uint32(seed % 2**32),
+                         self._noise_field_buffer)
+        self._noise_field_seed = seed
+        return self._noise_field_buffer
+
+    def _next_result_image(self):
+        self._events = []
+        self._image_index = (self._image_index + 1) % len(self._result_images)
+        copy_event = self._copy_events[self._image_index]
+        return [] if copy_event is None else [copy_event]
+
+    def _read_result(self, event, result, blocking):
+        command_queue.flush()
+        if result is None:
+            return None if blocking else Future(event, None)
+
+        copy_event = cl.enqueue_copy(copy_queue,
+                                     result,
+                                     self._result_image,
+                                     origin=(0, 0),
+                                     region=self.shape,
+                                     wait_for=[event],
+                                     is_blocking=blocking)
+        self._copy_events[self._image_index] = copy_event
+        self._events.append(('copy', copy_event))
+        if blocking:
+            return result
+        copy_queue.flush()
+        return Future(copy_event, result)
+
+    def _copy_numpy_result(self, result, blocking=True):
+        if result is not None:
+            result[...] = self._result_image
+        if not blocking:
+            return Future(None, result)
+        return result
+
+    def read(self, result=None):
+        if result is None:
+            result = np.empty((self._image_height, self._image_width, 4),
+                              np.uint8)
+        if self._backend == 'numpy':
+            result[...] = self._result_image
+            return result
+
+        is_gl_texture = hasattr(self._result_image, 'gl_object')
+        if is_gl_texture:
+            cl.enqueue_acquire_gl_objects(command_queue, [self._result_image])
+        cl.enqueue_copy(command_queue,
+                        result,
+                        self._result_image,
+                        origin=(0, 0),
+                        region=self.shape)
+        if is_gl_texture:
+            cl.enqueue_release_gl_objects(command_queue, [self._result_image])
+        command_queue.finish()
+        return result
+
+    def write(self, image):
+        if self._backend == 'numpy':
+            self._result_image[...] = image
+            return
+
+        wait_for = self._copy_events[self._image_index]
+        is_gl_texture = hasattr(self._result_image, 'gl_object')
+        if is_gl_texture:
+            cl.enqueue_acquire_gl_objects(command_queue, [self._result_image])
+        cl.enqueue_copy(command_queue,
+                        self._result_image,
+                        np.ascontiguousarray(image),
+                        origin=(0, 0),
+                        region=self.shape,
+                        wait_for=None if wait_for is None else [wait_for])
+        if is_gl_texture:
+            cl.enqueue_release_gl_objects(command_queue, [self._result_image])
+        command_queue.finish()
+
+    def _batch(self,
+               kernel_name,
+               cpu_function,
+               parameters,
+               result,
+               kernel_args=(),
+               seed=0):
+        parameters = np.broadcast_arrays(
+            *[np.asarray(p, np.float32) for p in parameters])
+        parameters = np.ascontiguousarray(
+            np.stack([p.ravel() for p in parameters], axis=-1))
+        n_images = parameters.shape[0]
+        width, height = self._image_width, self._image_height
+
+        if result is None:
+            result = np.empty((n_images, height, width, 4), np.uint8)
+        if result.shape != (n_images, height, width, 4):
+            raise ValueError(
+                f'Batch result needs the shape {(n_images, height, width, 4)}.')
+
+        if self._backend == 'numpy':
+            for i, (image, p) in enumerate(zip(result, parameters)):
+                cpu_function(width, height, *p.tolist(), image, seed=seed + i)
+            return result
+
+        self._events = []
+        parameter_buffer = cl.Buffer(context,
+                                     mem.READ_ONLY | mem.COPY_HOST_PTR,
+                                     hostbuf=parameters)
+        result_buffer = cl.Buffer(context, mem.WRITE_ONLY, result.nbytes)
+        self._launch(kernel_name, (width, height, n_images), np.uint32(width),
+                     np.uint32(height), parameter_buffer,
+                     np.uint32(seed % 2**32), *kernel_args, result_buffer)
+        self._events.append(
+            ('copy', cl.enqueue_copy(command_queue, result, result_buffer)))
+        return result
+
 
 class Line(Base):
-    def __init__(self, image_width, image_height, gl_image=None):
+    def __init__(self,
+                 image_width,
+                 image_height,
+                 gl_image=None,
+                 backend='opencl',
+                 local_size=None,
+                 n_buffers=1,
+                 noise_field=False):
         super().__init__(
             image_width, image_height,
             os.path.join(os.path.dirname(__file__), 'filtered_line.cl'),
-            gl_image=gl_image)
+            gl_image=gl_image,
+            backend=backend,
+            local_size=local_size,
+            n_buffers=n_buffers,
+            noise_field=noise_field)
 
     def __call__(self,
                  line_x: float,
@@ -89,39 +537,115 @@ class Line(Base):
                  filter_noise: float,
                  filter_samples: float,
                  image_angle: float,
-                 result: np.array = None) -> np.array:
-        shape = self._result_image.shape
+                 result: np.array = None,
+                 blocking: bool = True,
+                 seed: int = 0,
+                 regions=None):
+        # the numpy backend always renders the whole image
+        if self._backend == 'numpy':
+            height, width = self._result_image.shape[:2]
+            cpu.filtered_line(
+                width, height, line_x, line_y, line_angle,
+                max(1.0, filter_radius), filter_noise, filter_samples,
+                image_angle, self._result_image, seed,
+                self.update_noise_field(seed) if filter_noise > 0.0 else None)
+            return self._copy_numpy_result(result, blocking)
+
+        shape = self.shape
+        wait_for = self._next_result_image()
+        noise_field = (self.update_noise_field(seed)
+                       if filter_noise > 0.0 else None)
 
         if hasattr(self._result_image, 'gl_object'):
-            cl.enqueue_acquire_gl_objects(command_queue, [self._result_image])
-        self._program.filtered_line(command_queue, shape, (1, 1),
-                                    np.uint32(shape[1]), np.uint32(shape[0]),
-                                    np.float32(line_x), np.float32(line_y),
-                                    np.float32(line_angle),
-                                    np.float32(max(1.0, filter_radius)),
-                                    np.float32(filter_noise),
-                                    np.float32(filter_samples),
-                                    np.float32(image_angle),
-                                    self._result_image)
+            self._events.append(('acquire',
+                                 cl.enqueue_acquire_gl_objects(
+                                     command_queue, [self._result_image])))
+        event = self._launch_regions('filtered_line',
+                                     regions,
+                                     np.uint32(shape[0]),
+                                     np.uint32(shape[1]),
+                                     np.float32(line_x),
+                                     np.float32(line_y),
+                                     np.float32(line_angle),
+                                     np.float32(max(1.0, filter_radius)),
+                                     np.float32(filter_noise),
+                                     np.float32(filter_samples),
+                                     np.float32(image_angle),
+                                     np.uint32(seed % 2**32),
+                                     noise_field,
+                                     self._result_image,
+                                     wait_for=wait_for)
         if hasattr(self._result_image, 'gl_object'):
-            cl.enqueue_release_gl_objects(command_queue, [self._result_image])
+            event = cl.enqueue_release_gl_objects(command_queue,
+                                                  [self._result_image])
+            self._events.append(('release', event))
 
-        if result is not None:
-            cl.enqueue_copy(command_queue,
-                            result,
-                            self._result_image,
-                            origin=(0, 0),
-                            region=shape)
-            return result
+        return self._read_result(event, result, blocking)
+
+    def batch(self,
+              line_x,
+              line_y,
+              line_angle,
+              filter_radius,
+              filter_noise,
+              filter_samples,
+              image_angle,
+              result: np.array = None,
+              seed: int = 0) -> np.array:
+        return self._batch(
+            'filtered_line_batch',
+            cpu.filtered_line,
+            (line_x, line_y, line_angle, np.maximum(1.0, filter_radius),
+             filter_noise, filter_samples, image_angle), result, seed=seed)
 
 
 class ArtifactLine(Base):
-    def __init__(self, image_width, image_height, gl_image=None):
+    def __init__(self,
+                 image_width,
+                 image_height,
+                 gl_image=None,
+                 backend='opencl',
+                 local_size=None,
+                 n_buffers=1,
+                 circle_area_table=False,
+                 line_staircase=False,
+                 sample_profile=False,
+                 noise_field=False):
         super().__init__(
             image_width, image_height,
             os.path.join(os.path.dirname(__file__),
                          'filtered_line_artifact.cl'),
-            gl_image=gl_image)
+            gl_image=gl_image,
+            backend=backend,
+            local_size=local_size,
+            n_buffers=n_buffers,
+            noise_field=noise_field)
+
+        self._line_staircase = line_staircase
+        self._sample_profile = sample_profile
+        self._circle_area_table = None
+        self._circle_area_table_buffer = None
+        if circle_area_table:
+            self._circle_area_table = cpu.circle_area_table(
+                *circle_area_table_size)
+            if backend == 'opencl':
+                self._circle_area_table_buffer = cl.Buffer(
+                    context,
+                    mem.READ_ONLY | mem.COPY_HOST_PTR,
+                    hostbuf=self._circle_area_table)
+
+    @property
+    def circle_area_table_error(self):
+        if self._circle_area_table is None:
+            return 0.0
+        return cpu.circle_area_table_error(self._circle_area_table)
+
+    def circle_area_table_error_estimate(self, filter_radius, artifact_size):
+        # empirical, not a guaranteed bound: the worst per-column error seen
+        # on random samples times the number of columns under the filter
+        columns = np.ceil((2.0 * filter_radius + artifact_size) /
+                          artifact_size) + 1
+        return columns * self.circle_area_table_error
 
     def __call__(self,
                  line_x: float,
@@ -134,33 +658,138 @@ class ArtifactLine(Base):
                  filter_radius_noise: float,
                  image_angle: float,
                  image_samples: int,
-                 result: np.array = None):
-        shape = self._result_image.shape
+                 result: np.array = None,
+                 blocking: bool = True,
+                 seed: int = 0,
+                 regions=None):
+        noisy = filter_noise > 0.0 or filter_radius_noise > 0.0
+        # the numpy backend always renders the whole image
+        if self._backend == 'numpy':
+            height, width = self._result_image.shape[:2]
+            cpu.filtered_line_artifact(width, height, artifact_size, line_x,
+                                       line_y, line_angle, filter_radius,
+                                       filter_noise, filter_samples,
+                                       filter_radius_noise, image_angle,
+                                       image_samples, self._result_image,
+                                       self._circle_area_table,
+                                       self._sample_profile, seed,
+                                       self.update_noise_field(seed)
+                                       if noisy else None)
+            return self._copy_numpy_result(result, blocking)
+
+        shape = self.shape
+        wait_for = self._next_result_image()
+        noise_field = self.update_noise_field(seed) if noisy else None
         is_gl_texture = hasattr(self._result_image, 'gl_object')
+        line_steps, line_step_offsets = self._line_staircase_buffers(
+            shape, line_x, line_y, line_angle, artifact_size, filter_radius,
+            filter_radius_noise, image_angle, image_samples)
+        sample_profile = self._sample_profile_buffer(
+            line_x, line_y, line_angle, artifact_size, filter_radius,
+            filter_radius_noise, image_samples)
 
         if is_gl_texture:
-            cl.enqueue_acquire_gl_objects(command_queue, [self._result_image])
-        self._program.filtered_line_artifact(command_queue, shape, (1, 1),
-                                             np.uint32(shape[1]),
-                                             np.uint32(shape[0]),
-                                             np.uint32(artifact_size),
-                                             np.float32(line_x),
-                                             np.float32(line_y),
-                                             np.float32(line_angle),
-                                             np.float32(filter_radius),
-                                             np.float32(filter_noise),
-                                             np.float32(filter_samples),
-                                             np.float32(filter_radius_noise),
-                                             np.float32(image_angle),
-                                             np.uint32(image_samples),
-                                             self._result_image)
+            self._events.append(('acquire',
+                                 cl.enqueue_acquire_gl_objects(
+                                     command_queue, [self._result_image])))
+        event = self._launch_regions('filtered_line_artifact',
+                                     regions,
+                                     np.uint32(shape[0]),
+                                     np.uint32(shape[1]),
+                                     np.uint32(artifact_size),
+                                     np.float32(line_x),
+                                     np.float32(line_y),
+                                     np.float32(line_angle),
+                                     np.float32(filter_radius),
+                                     np.float32(filter_noise),
+                                     np.float32(filter_samples),
+                                     np.float32(filter_radius_noise),
+                                     np.float32(image_angle),
+                                     np.uint32(image_samples),
+                                     np.uint32(seed % 2**32),
+                                     noise_field,
+                                     self._circle_area_table_buffer,
+                                     line_steps,
+                                     line_step_offsets,
+                                     sample_profile,
+                                     self._result_image,
+                                     wait_for=wait_for)
         if is_gl_texture:
-            cl.enqueue_release_gl_objects(command_queue, [self._result_image])
+            event = cl.enqueue_release_gl_objects(command_queue,
+                                                  [self._result_image])
+            self._events.append(('release', event))
 
-        if result is not None:
-            cl.enqueue_copy(command_queue,
-                            result,
-                            self._result_image,
-                            origin=(0, 0),
-                            region=shape)
-            return result
+        return self._read_result(event, result, blocking)
+
+    def _line_staircase_buffers(self, shape, line_x, line_y, line_angle,
+                                artifact_size, filter_radius,
+                                filter_radius_noise, image_angle,
+                                image_samples):
+        if not self._line_staircase:
+            return None, None
+        max_filter_radius = filter_radius * (1.0 + filter_radius_noise / 2.0)
+        steps, offsets = cpu.line_staircases(shape[0], shape[1], line_x,
+                                             line_y, line_angle,
+                                             max(1, artifact_size),
+                                             max_filter_radius, image_angle,
+                                             max(1, image_samples))
+        return (cl.Buffer(context,
+                          mem.READ_ONLY | mem.COPY_HOST_PTR,
+                          hostbuf=steps),
+                cl.Buffer(context,
+                          mem.READ_ONLY | mem.COPY_HOST_PTR,
+                          hostbuf=offsets))
+
+    def _sample_profile_buffer(self, line_x, line_y, line_angle, artifact_size,
+                               filter_radius, filter_radius_noise,
+                               image_samples):
+        if not self._sample_profile or image_samples <= 1:
+            return None
+        # steep lines are rendered brute force, see cpu.sample_profile_supported
+        if not cpu.sample_profile_supported(line_angle, image_samples):
+            return None
+        min_s, step_s, n_s, n_radii = cpu.sample_profile_size(
+            artifact_size, filter_radius, filter_radius_noise)
+        sample_profile = cl.Buffer(context, mem.READ_WRITE,
+                                   4 * (6 + n_s * n_radii))
+        self._launch('filtered_line_sample_profile', (n_s, n_radii),
+                     np.uint32(artifact_size), np.float32(line_x),
+                     np.float32(line_y), np.float32(line_angle),
+                     np.float32(filter_radius),
+                     np.float32(filter_radius_noise), np.uint32(image_samples),
+                     np.float32(min_s), np.float32(step_s), np.uint32(n_s),
+                     np.uint32(n_radii), self._circle_area_table_buffer,
+                     sample_profile)
+        return sample_profile
+
+    def batch(self,
+              line_x,
+              line_y,
+              line_angle,
+              artifact_size,
+              filter_radius,
+              filter_noise,
+              filter_samples,
+              filter_radius_noise,
+              image_angle,
+              image_samples,
+              result: np.array = None,
+              seed: int = 0) -> np.array:
+        return self._batch(
+            'filtered_line_artifact_batch',
+            self._cpu_batch_image,
+            (artifact_size, line_x, line_y, line_angle, filter_radius,
+             filter_noise, filter_samples, filter_radius_noise, image_angle,
+             image_samples), result, (self._circle_area_table_buffer, ),
+            seed=seed)
+
+    def _cpu_batch_image(self, width, height, artifact_size, line_x, line_y,
+                         line_angle, filter_radius, filter_noise,
+                         filter_samples, filter_radius_noise, image_angle,
+                         image_samples, result, seed=0):
+        cpu.filtered_line_artifact(width, height, int(artifact_size), line_x,
+                                   line_y, line_angle, filter_radius,
+                                   filter_noise, filter_samples,
+                                   filter_radius_noise, image_angle,
+                                   int(image_samples), result,
+                                   self._circle_area_table, seed=seed)
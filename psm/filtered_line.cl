@@ -2,6 +2,41 @@
 #include "image_rotation.cl" // rotate_point_arround_image_center, rotate_point
 #include "random.cl"
 
+float filtered_line_color(const unsigned int width,
+                          const unsigned int height,
+                          const float line_x,
+                          const float line_y,
+                          const float line_angle,
+                          const float filter_radius,
+                          const float filter_noise,
+                          const float filter_samples,
+                          const float image_angle,
+                          const unsigned int seed,
+                          __global const float4* noise_field,
+                          const size_t col,
+                          const size_t row)
+{
+    const float cx = width * 0.5f;
+    const float cy = height * 0.5f;
+
+    float filter_x = (float)col;
+    float filter_y = (float)row;
+
+    rotate_point(cx, cy, image_angle, &filter_x, &filter_y);
+
+    float color = estimate_circle_half_space_overlap(
+        filter_x, filter_y, filter_radius, line_x, line_y, line_angle);
+
+    if (0.0f < color && color < 1.0f && filter_noise > 0.0f)
+        color += filter_noise
+                 * pixel_poisson_noise(seed,
+                                       (uint)(row * width + col),
+                                       filter_samples * color,
+                                       noise_field);
+
+    return min(max(color, 0.0f), 1.0f);
+}
+
 __kernel void filtered_line(const unsigned int width,
                             const unsigned int height,
                             const float line_x,
@@ -11,25 +46,53 @@ __kernel void filtered_line(const unsigned int width,
                             const float filter_noise,
                             const float filter_samples,
                             const float image_angle,
+                            const unsigned int seed,
+                            __global const float4* noise_field,
                             __write_only image2d_t result)
 {
     const size_t col = get_global_id(0);
     const size_t row = get_global_id(1);
-    const float cx = width * 0.5f;
-    const float cy = height * 0.5f;
+    if (col >= width || row >= height)
+        return;
 
-    float filter_x = (float)col;
-    float filter_y = (float)row;
+    const float color = filtered_line_color(width,
+                                            height,
+                                            line_x,
+                                            line_y,
+                                            line_angle,
+                                            filter_radius,
+                                            filter_noise,
+                                            filter_samples,
+                                            image_angle,
+                                            seed,
+                                            noise_field,
+                                            col,
+                                            row);
 
-    rotate_point(cx, cy, image_angle, &filter_x, &filter_y);
+    write_imagef(result, (int2)(col, row), (float4)(color, color, color, 1.0f));
+}
 
-    float color = estimate_circle_half_space_overlap(
-        filter_x, filter_y, filter_radius, line_x, line_y, line_angle);
+// parameters holds one row of (line_x, line_y, line_angle, filter_radius,
+// filter_noise, filter_samples, image_angle) per image of the batch, image
+// i uses the seed + i
+__kernel void filtered_line_batch(const unsigned int width,
+                                  const unsigned int height,
+                                  __global const float* parameters,
+                                  const unsigned int seed,
+                                  __global uchar4* result)
+{
+    const size_t col = get_global_id(0);
+    const size_t row = get_global_id(1);
+    const size_t index = get_global_id(2);
+    if (col >= width || row >= height)
+        return;
 
-    if (0.0f < color && color < 1.0f)
-        color += filter_noise * poisson_noise(filter_x, filter_y, filter_samples * color);
+    __global const float* p = parameters + index * 7;
 
-    color = min(max(color, 0.0f), 1.0f);
+    const float color = filtered_line_color(
+        width, height, p[0], p[1], p[2], p[3], p[4], p[5], p[6],
+        seed + (uint)index, 0, col, row);
 
-    write_imagef(result, (int2)(col, row), (float4)(color, color, color, 1.0f));
+    result[(index * height + row) * width + col] =
+        convert_uchar4_sat_rte((float4)(color, color, color, 1.0f) * 255.0f);
 }
@@ -3,13 +3,65 @@
 #include "circle.cl"
 #include "random.cl"
 
+float staircase_area(const float c0,
+                     const float c1,
+                     const float r1,
+                     const float filter_radius,
+                     const float filter_radius2,
+                     __global const float* circle_area_table)
+{
+    float a;
+    if (circle_area_table) {
+        a = lookup_circle_infinite_bar_area(circle_area_table,
+                                            c0,
+                                            c1,
+                                            fabs(r1),
+                                            filter_radius,
+                                            filter_radius2);
+        if (r1 > 0)
+            a = lookup_circle_interval_area(
+                    circle_area_table, c0, c1, filter_radius, filter_radius2)
+                - a;
+    } else {
+        a = estimate_circle_infinite_bar_area(
+            c0, c1, fabs(r1), filter_radius, filter_radius2);
+        if (r1 > 0)
+            a = estimate_circle_interval_area(
+                    c0, c1, filter_radius, filter_radius2)
+                - a;
+    }
+    return a;
+}
+
+// line_steps holds the precomputed staircase of the rasterized line as
+// (x, y) pairs: the rasterized line has the height y from x up to the x of
+// the next step. The last entry only marks the end of the staircase.
+uint find_line_step(__global const float2* line_steps,
+                    const uint n_line_steps,
+                    const float x)
+{
+    uint first = 0;
+    uint last = n_line_steps - 1;
+    while (last - first > 1) {
+        const uint middle = (first + last) / 2;
+        if (line_steps[middle].x <= x)
+            first = middle;
+        else
+            last = middle;
+    }
+    return first;
+}
+
 float filter_line(const float line_x,
                   const float line_y,
                   const float line_angle,
                   const float artifact_size,
                   const float filter_x,
                   const float filter_y,
-                  const float filter_radius)
+                  const float filter_radius,
+                  __global const float* circle_area_table,
+                  __global const float2* line_steps,
+                  const uint n_line_steps)
 {
     const float maxR = filter_radius + artifact_size;
     const float line_nx = -sin(line_angle);
@@ -36,65 +88,166 @@ float filter_line(const float line_x,
     }
 
     float area = 0.0f;
-    while (c0 <= filter_radius) {
-        const float c1 = c0 + artifact_size;
-        const float r1 =
-            rasterize_line_y(artifact_size, k, d, c0 + pixel_center_shift)
-            - filter_y;
-        float a = estimate_circle_infinite_bar_area(
-            c0, c1, fabs(r1), filter_radius, filter_radius2);
-        if (r1 > 0)
-            a = estimate_circle_interval_area(
-                    c0, c1, filter_radius, filter_radius2)
-                - a;
-        area += a;
-        c0 = c1;
+    if (line_steps) {
+        for (uint i = find_line_step(
+                 line_steps, n_line_steps, filter_x - filter_radius);
+             i + 1 < n_line_steps;
+             ++i) {
+            const float2 step = line_steps[i];
+            c0 = step.x - filter_x;
+            if (c0 > filter_radius)
+                break;
+            area += staircase_area(c0,
+                                   line_steps[i + 1].x - filter_x,
+                                   step.y - filter_y,
+                                   filter_radius,
+                                   filter_radius2,
+                                   circle_area_table);
+        }
+    } else {
+        while (c0 <= filter_radius) {
+            const float c1 = c0 + artifact_size;
+            const float r1 =
+                rasterize_line_y(artifact_size, k, d, c0 + pixel_center_shift)
+                - filter_y;
+            area += staircase_area(
+                c0, c1, r1, filter_radius, filter_radius2, circle_area_table);
+            c0 = c1;
+        }
     }
 
-    // float area = 0.0f;
-    // while (c0 <= filter_radius) {
-    //     float r1 =
-    //         rasterize_line_y(artifact_size, k, d, c0 + pixel_center_shift);
-    //     const float c1 = next_line_step_x(artifact_size, k, d, r1) - filter_x;
-    //     r1 -= filter_y;
-    //     float a = estimate_circle_infinite_bar_area(
-    //         c0, c1, fabs(r1), filter_radius, filter_radius2);
-    //     if (r1 > 0)
-    //         a = estimate_circle_interval_area(
-    //                 c0, c1, filter_radius, filter_radius2)
-    //             - a;
-    //     area += a;
-    //     c0 = c1;
-    // }
-
     const float circle_area = estimate_circle_area2(filter_radius2);
     return min(max(area / circle_area, 0.0f), 1.0f);
 }
 
-__kernel void filtered_line_artifact(const unsigned int width,
-                                     const unsigned int height,
-                                     const unsigned int artifact_size,
-                                     const float line_x,
-                                     const float line_y,
-                                     const float line_angle,
-                                     const float filter_radius,
-                                     const float filter_noise,
-                                     const float filter_samples,
-                                     const float filter_radius_noise,
-                                     const float image_angle,
-                                     const unsigned int image_samples,
-                                     __write_only image2d_t result)
+#ifndef SAMPLE_PROFILE_SAMPLES
+#define SAMPLE_PROFILE_SAMPLES 32
+#endif
+
+// The sample profile holds the summed color of the rotated image samples
+// 1 to image_samples - 1 as a function of the signed distance s to the line,
+// averaged along the line. It starts with the header (min_s, step_s, n_s,
+// n_radii, min_radius, step_radius), followed by one row of n_s values per
+// filter radius. It is only valid while every rotated sample angle
+// line_angle + 40 deg / i stays within (-pi/2, pi/2), so for line_angle in
+// about (-1.571, 0.873) rad; the host renders steeper lines brute force (see
+// sample_profile_supported in cpu.py).
+float lookup_sample_profile(__global const float* sample_profile,
+                            const float s,
+                            const float radius)
+{
+    const int n_s = (int)sample_profile[2];
+    const int n_radii = (int)sample_profile[3];
+    const float u = clamp((s - sample_profile[0]) / sample_profile[1],
+                          0.0f,
+                          (float)(n_s - 1));
+    const int i = min((int)u, n_s - 2);
+    __global const float* row = sample_profile + 6;
+
+    if (n_radii == 1)
+        return mix(row[i], row[i + 1], u - (float)i);
+
+    const float v = clamp((radius - sample_profile[4]) / sample_profile[5],
+                          0.0f,
+                          (float)(n_radii - 1));
+    const int j = min((int)v, n_radii - 2);
+    row += j * n_s;
+    return mix(mix(row[i], row[i + 1], u - (float)i),
+               mix(row[n_s + i], row[n_s + i + 1], u - (float)i),
+               v - (float)j);
+}
+
+__kernel void filtered_line_sample_profile(const unsigned int artifact_size,
+                                           const float line_x,
+                                           const float line_y,
+                                           const float line_angle,
+                                           const float filter_radius,
+                                           const float filter_radius_noise,
+                                           const unsigned int image_samples,
+                                           const float min_s,
+                                           const float step_s,
+                                           const unsigned int n_s,
+                                           const unsigned int n_radii,
+                                           __global const float* circle_area_table,
+                                           __global float* sample_profile)
+{
+    const size_t i_s = get_global_id(0);
+    const size_t i_r = get_global_id(1);
+    if (i_s >= n_s || i_r >= n_radii)
+        return;
+
+    const float min_radius = filter_radius * (1.0f - filter_radius_noise / 2);
+    const float step_radius =
+        n_radii > 1 ? filter_radius * filter_radius_noise / (n_radii - 1) : 0.0f;
+    if (i_s == 0 && i_r == 0) {
+        sample_profile[0] = min_s;
+        sample_profile[1] = step_s;
+        sample_profile[2] = (float)n_s;
+        sample_profile[3] = (float)n_radii;
+        sample_profile[4] = min_radius;
+        sample_profile[5] = step_radius;
+    }
+
+    const float s = min_s + i_s * step_s;
+    const float radius = min_radius + i_r * step_radius;
+    const float span = 2.0f * (radius + artifact_size);
+
+    float color = 0.0f;
+    for (unsigned int i = 1; i < image_samples; ++i) {
+        const float angle = line_angle + (40.0f / i) * M_PI / 180.0f;
+        const float line_nx = -sin(angle);
+        const float line_ny = cos(angle);
+        for (unsigned int j = 0; j < SAMPLE_PROFILE_SAMPLES; ++j) {
+            const float t =
+                ((j + 0.5f) / SAMPLE_PROFILE_SAMPLES - 0.5f) * span;
+            color += filter_line(line_x,
+                                 line_y,
+                                 angle,
+                                 artifact_size,
+                                 line_x + s * line_nx + t * line_ny,
+                                 line_y + s * line_ny - t * line_nx,
+                                 radius,
+                                 circle_area_table,
+                                 0,
+                                 0);
+        }
+    }
+
+    sample_profile[6 + i_r * n_s + i_s] = color / SAMPLE_PROFILE_SAMPLES;
+}
+
+float filtered_line_artifact_color(const unsigned int width,
+                                   const unsigned int height,
+                                   const unsigned int artifact_size,
+                                   const float line_x,
+                                   const float line_y,
+                                   const float line_angle,
+                                   const float filter_radius,
+                                   const float filter_noise,
+                                   const float filter_samples,
+                                   const float filter_radius_noise,
+                                   const float image_angle,
+                                   const unsigned int image_samples,
+                                   const unsigned int seed,
+                                   __global const float4* noise_field,
+                                   __global const float* circle_area_table,
+                                   __global const float2* line_steps,
+                                   __global const uint* line_step_offsets,
+                                   __global const float* sample_profile,
+                                   const float col,
+                                   const float row)
 {
-    const float col = (float)get_global_id(0);
-    const float row = (float)get_global_id(1);
     const float cx = width * 0.5f;
     const float cy = height * 0.5f;
 
     float filter_x = col;
     float filter_y = row;
+    const uint pixel = (uint)row * width + (uint)col;
     float radius = filter_radius;
     if (filter_radius_noise > 0.0f)
-        radius *= (filter_radius_noise * randf(line_x + row, line_y + col) + (1.0f - filter_radius_noise / 2));
+        radius *= (filter_radius_noise
+                       * pixel_radius_noise(seed, pixel, noise_field)
+                   + (1.0f - filter_radius_noise / 2));
 
     rotate_point(cx, cy, image_angle, &filter_x, &filter_y);
 
@@ -104,10 +257,22 @@ __kernel void filtered_line_artifact(const unsigned int width,
                               artifact_size,
                               filter_x,
                               filter_y,
-                              radius);
+                              radius,
+                              circle_area_table,
+                              line_steps,
+                              line_steps ? line_step_offsets[1]
+                                               - line_step_offsets[0]
+                                         : 0);
     const bool in_penumbra = 0.0f < color && color < 1.0f;
 
-    for (unsigned int i = 1; i < image_samples; ++i) {
+    if (sample_profile && image_samples > 1) {
+        const float line_nx = -sin(line_angle);
+        const float line_ny = cos(line_angle);
+        const float s = (filter_x - line_x) * line_nx + (filter_y - line_y) * line_ny;
+        color += lookup_sample_profile(sample_profile, s, radius);
+    }
+
+    for (unsigned int i = 1; !sample_profile && i < image_samples; ++i) {
         const float rotation = (40.0f / i) * M_PI / 180.0f;
 
         float sample_x = filter_x;
@@ -120,14 +285,112 @@ __kernel void filtered_line_artifact(const unsigned int width,
                              artifact_size,
                              sample_x,
                              sample_y,
-                             radius);
+                             radius,
+                             circle_area_table,
+                             line_steps ? line_steps + line_step_offsets[i] : 0,
+                             line_steps ? line_step_offsets[i + 1]
+                                              - line_step_offsets[i]
+                                        : 0);
     }
     color /= (float)image_samples;
 
     if (in_penumbra && filter_noise > 0.0f)
-        color += filter_noise * poisson_noise(filter_x, filter_y, filter_samples * color);
+        color += filter_noise
+                 * pixel_poisson_noise(
+                     seed, pixel, filter_samples * color, noise_field);
 
-    color = min(max(color, 0.0f), 1.0f);
+    return min(max(color, 0.0f), 1.0f);
+}
+
+__kernel void filtered_line_artifact(const unsigned int width,
+                                     const unsigned int height,
+                                     const unsigned int artifact_size,
+                                     const float line_x,
+                                     const float line_y,
+                                     const float line_angle,
+                                     const float filter_radius,
+                                     const float filter_noise,
+                                     const float filter_samples,
+                                     const float filter_radius_noise,
+                                     const float image_angle,
+                                     const unsigned int image_samples,
+                                     const unsigned int seed,
+                                     __global const float4* noise_field,
+                                     __global const float* circle_area_table,
+                                     __global const float2* line_steps,
+                                     __global const uint* line_step_offsets,
+                                     __global const float* sample_profile,
+                                     __write_only image2d_t result)
+{
+    const size_t col = get_global_id(0);
+    const size_t row = get_global_id(1);
+    if (col >= width || row >= height)
+        return;
+
+    const float color = filtered_line_artifact_color(width,
+                                                     height,
+                                                     artifact_size,
+                                                     line_x,
+                                                     line_y,
+                                                     line_angle,
+                                                     filter_radius,
+                                                     filter_noise,
+                                                     filter_samples,
+                                                     filter_radius_noise,
+                                                     image_angle,
+                                                     image_samples,
+                                                     seed,
+                                                     noise_field,
+                                                     circle_area_table,
+                                                     line_steps,
+                                                     line_step_offsets,
+                                                     sample_profile,
+                                                     (float)col,
+                                                     (float)row);
 
     write_imagef(result, (int2)(col, row), (float4)(color, color, color, 1.0f));
+}
+
+// parameters holds one row of (artifact_size, line_x, line_y, line_angle,
+// filter_radius, filter_noise, filter_samples, filter_radius_noise,
+// image_angle, image_samples) per image of the batch, image i uses the
+// seed + i
+__kernel void filtered_line_artifact_batch(const unsigned int width,
+                                           const unsigned int height,
+                                           __global const float* parameters,
+                                           const unsigned int seed,
+                                           __global const float* circle_area_table,
+                                           __global uchar4* result)
+{
+    const size_t col = get_global_id(0);
+    const size_t row = get_global_id(1);
+    const size_t index = get_global_id(2);
+    if (col >= width || row >= height)
+        return;
+
+    __global const float* p = parameters + index * 10;
+
+    const float color = filtered_line_artifact_color(width,
+                                                     height,
+                                                     (unsigned int)p[0],
+                                                     p[1],
+                                                     p[2],
+                                                     p[3],
+                                                     p[4],
+                                                     p[5],
+                                                     p[6],
+                                                     p[7],
+                                                     p[8],
+                                                     (unsigned int)p[9],
+                                                     seed + (uint)index,
+                                                     0,
+                                                     circle_area_table,
+                                                     0,
+                                                     0,
+                                                     0,
+                                                     (float)col,
+                                                     (float)row);
+
+    result[(index * height + row) * width + col] =
+        convert_uchar4_sat_rte((float4)(color, color, color, 1.0f) * 255.0f);
 }
\ No newline at end of file
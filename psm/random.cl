@@ -1,59 +1,115 @@
 #include "define.cl"
 
-float randf(const float seedx, const float seedy)
+#define PHILOX_M 0xD256D193u
+#define PHILOX_W 0x9E3779B9u
+#define RADIUS_NOISE_STREAM 0u
+#define POISSON_NOISE_STREAM 1u
+#define POISSON_INVERSION_LIMIT 12.0f
+#define POISSON_MAX_COUNT 64.0f
+
+// Philox2x32-10 (Salmon et al. 2011), a counter-based generator: the same
+// (counter, key) pair gives the same bits on every device and in psm.cpu
+uint2 philox2x32(uint2 counter, uint key)
 {
-    float floor_part;
-    return fract(sin(dot((float2)(seedx, seedy), (float2)(12.9898f, 78.233f)))
-                     * 43758.5453f,
-                 &floor_part);
+    for (uint i = 0; i < 10; ++i) {
+        const uint hi = mul_hi(PHILOX_M, counter.x);
+        const uint lo = PHILOX_M * counter.x;
+        counter = (uint2)(hi ^ key ^ counter.y, lo);
+        key += PHILOX_W;
+    }
+    return counter;
 }
 
-float poison_distribution(const float expected, const float observed)
+uint2 random_bits(const uint seed, const uint pixel, const uint stream)
 {
-    return exp(-expected - 1.0f)
-           * powr((float)M_E * expected / observed, observed);
+    return philox2x32((uint2)(pixel, stream), seed);
 }
 
-float random_poisson(const float seedx,
-                     const float seedy,
-                     const float expected,
-                     float start,
-                     float stop)
+// uniform in (0, 1), exact in float
+float random_uniform(const uint bits)
 {
-#define n 10
-    float cdf[n];
-
-    start = max(0.0f, start);
-    stop = max(0.0f, stop);
-
-    const float p = randf(seedx, seedy);
+    return (float)((bits >> 8) | 1u) * 0x1.0p-24f;
+}
 
-    cdf[0] = poison_distribution(expected, start);
+float standard_normal(const uint2 bits)
+{
+    // Box-Muller
+    return sqrt(-2.0f * log(random_uniform(bits.x)))
+           * cos(2.0f * (float)M_PI * random_uniform(bits.y));
+}
 
-    const float step = (stop - start) / (float)n;
-    for (uint i = 1; i < n; ++i) {
-        start += step;
-        cdf[i] = cdf[i - 1] - cdf[0] + poison_distribution(expected, start);
+// u is the uniform quantile for small expectations, z the normal quantile
+// for large ones
+float random_poisson(const float u, const float z, const float expected)
+{
+    if (expected < POISSON_INVERSION_LIMIT) {
+        // inversion by sequential search, expected + 1 steps on average
+        float p = exp(-expected);
+        float cdf = p;
+        float k = 0.0f;
+        while (cdf < u && k < POISSON_MAX_COUNT) {
+            k += 1.0f;
+            p *= expected / k;
+            cdf += p;
+        }
+        return k;
     }
 
-    cdf[0] /= cdf[n - 1];
+    // normal approximation
+    return max(expected + sqrt(expected) * z, 0.0f);
+}
+
+// relative deviation of a Poisson count from its expectation, in [-1, 1]
+float poisson_noise(const float u, const float z, const float samples)
+{
+    if (samples <= 0.0f)
+        return 0.0f;
+    return min(max(random_poisson(u, z, samples) / samples - 1.0f, -1.0f),
+               1.0f);
+}
 
-    for (uint i = 1; i < n; ++i) {
-        cdf[i] /= cdf[n - 1];
-        if (cdf[i] >= p) {
-            const float f = (float)i;
-            const float t = (cdf[i - 1] - p) / (cdf[i - 1] - cdf[i]);
-            return ((f - 1.0f) * (1.0f - t) + f * t) / (float)n;
-        }
-    }
+// noise_field holds the quantiles (radius noise, Poisson uniform, Poisson
+// normal, 0) of every pixel, without it they are generated on the fly
+float pixel_radius_noise(const uint seed,
+                         const uint pixel,
+                         __global const float4* noise_field)
+{
+    if (noise_field)
+        return noise_field[pixel].x;
+    return random_uniform(random_bits(seed, pixel, RADIUS_NOISE_STREAM).x);
+}
 
-    return p;
-#undef n
+float pixel_poisson_noise(const uint seed,
+                          const uint pixel,
+                          const float samples,
+                          __global const float4* noise_field)
+{
+    if (noise_field)
+        return poisson_noise(
+            noise_field[pixel].y, noise_field[pixel].z, samples);
+    const uint2 bits = random_bits(seed, pixel, POISSON_NOISE_STREAM);
+    return poisson_noise(random_uniform(bits.x),
+                         samples < POISSON_INVERSION_LIMIT
+                             ? 0.0f
+                             : standard_normal(bits),
+                         samples);
 }
 
-float poisson_noise(const float seedx, const float seedy, const float samples)
+__kernel void fill_noise_field(const unsigned int width,
+                               const unsigned int height,
+                               const unsigned int seed,
+                               __global float4* field)
 {
-    const float rnd =
-        random_poisson(seedx, seedy, samples, 0.0f, 2 * samples);
-    return 2.0f * rnd - 1.0f;
-}
\ No newline at end of file
+    const size_t col = get_global_id(0);
+    const size_t row = get_global_id(1);
+    if (col >= width || row >= height)
+        return;
+
+    const uint pixel = (uint)(row * width + col);
+    const uint2 bits = random_bits(seed, pixel, POISSON_NOISE_STREAM);
+    field[pixel] = (float4)(
+        random_uniform(random_bits(seed, pixel, RADIUS_NOISE_STREAM).x),
+        random_uniform(bits.x),
+        standard_normal(bits),
+        0.0f);
+}
@@ -0,0 +1,228 @@
+import argparse
+import concurrent.futures
+import csv
+import glob
+import os
+import sys
+import time
+import numpy as np
+import csv2np
+import statistics
+
+eps = 1e-9
+
+
+def weibull(x, threshold, beta, delta=0.01, gamma=0.5, p_threshold=0.82):
+    # the psychometric function of the quests, p(threshold) == p_threshold
+    if gamma > p_threshold:
+        gamma = 0.5
+    q = (1 - (p_threshold - delta * gamma) / (1 - delta)) / (1 - gamma)
+    z = beta * (x - threshold) + np.log10(-np.log(q))
+    return delta * gamma + (1 - delta) * (1 - (1 - gamma) * np.exp(-10**z))
+
+
+def _take(values, index, axis):
+    return np.take_along_axis(values, np.expand_dims(index, axis),
+                              axis).squeeze(axis)
+
+
+def _refine(ll, index, axis):
+    # vertex of the parabola through the maximum and its neighbours
+    n = ll.shape[axis]
+    if n < 3:
+        return index.astype(np.float64)
+    i = np.clip(index, 1, n - 2)
+    l0, l1, l2 = (_take(ll, i - 1, axis), _take(ll, i, axis),
+                  _take(ll, i + 1, axis))
+    denominator = l0 - 2 * l1 + l2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(denominator < 0, 0.5 * (l0 - l2) / denominator, 0.0)
+    offset = np.where(index == i, np.clip(offset, -0.5, 0.5), 0.0)
+    return index + offset
+
+
+def fit(x, y, weights=None, delta=0.01, gamma=0.5, p_threshold=0.82,
+        beta=None, n_thresholds=81, n_betas=21, beta_range=(0.5, 50.0)):
+    # maximum likelihood on a (threshold, beta) grid, one fit per weight row,
+    # a given beta is kept fixed. A maximum in the outermost cell of the grid
+    # means the likelihood still rises beyond it, such fits are flagged.
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y, np.float64)
+    weights = np.ones((1, len(x))) if weights is None else np.atleast_2d(
+        weights)
+    span = max(np.ptp(x), 0.1)
+    # intensities scale the filter radius, there are no negative thresholds
+    thresholds = np.linspace(max(x.min() - 0.5 * span, 0.0),
+                             x.max() + 0.5 * span, n_thresholds)
+    if beta is None:
+        log_betas = np.linspace(*np.log(beta_range), n_betas)
+    else:
+        log_betas = np.log([beta])
+        n_betas = 1
+    p = weibull(x[:, None, None], thresholds[None, :, None],
+                np.exp(log_betas)[None, None, :], delta, gamma, p_threshold)
+    p = np.clip(p, eps, 1 - eps)
+    log_likelihood = y[:, None, None] * np.log(p) + (
+        1 - y[:, None, None]) * np.log(1 - p)
+    ll = weights @ log_likelihood.reshape(len(x), -1)
+    ll = ll.reshape(-1, n_thresholds, n_betas)
+
+    rows = np.arange(len(ll))
+    best = np.argmax(ll.reshape(len(ll), -1), axis=1)
+    i, j = np.unravel_index(best, (n_thresholds, n_betas))
+    j = _refine(ll[rows, i, :], j, 1)
+    i = _refine(ll[rows, :, np.round(j).astype(int)], i, 1)
+    threshold = np.interp(i, np.arange(n_thresholds), thresholds)
+    beta = np.exp(np.interp(j, np.arange(n_betas), log_betas))
+    at_edge = (i < 1) | (i > n_thresholds - 2)
+    if n_betas > 1:
+        at_edge |= (j < 1) | (j > n_betas - 2)
+    return threshold, beta, at_edge
+
+
+def bootstrap(x, y, n_samples, random, **kwargs):
+    # resampling the trials is a multinomial weight per trial
+    n = len(x)
+    weights = random.multinomial(n, np.full(n, 1.0 / n), size=n_samples)
+    weights = np.concatenate((np.ones((1, n)), weights))
+    threshold, beta, at_edge = fit(x, y, weights, **kwargs)
+    return (threshold[0], beta[0], at_edge[0], threshold[1:], beta[1:],
+            at_edge[1:])
+
+
+def fit_group(group, n_samples, confidence, free_beta, seed):
+    random = np.random.default_rng(seed)
+    x, y = group['intensity'], group['response']
+    threshold, beta, at_edge, thresholds, betas, edges = bootstrap(
+        x, y, n_samples, random, delta=group['delta'], gamma=group['gamma'],
+        p_threshold=group['pThreshold'],
+        beta=None if free_beta else group['beta'])
+    # samples stuck on the grid edge have no finite maximum, once they reach
+    # into a tail of the interval its percentile is not defined
+    q = [50 - confidence / 2, 50 + confidence / 2]
+    if at_edge or not len(edges) or edges.mean() > q[0] / 100:
+        threshold_ci = beta_ci = [np.nan, np.nan]
+    else:
+        threshold_ci = np.percentile(thresholds[~edges], q)
+        beta_ci = np.percentile(betas[~edges], q)
+    return {
+        'user': group['user'],
+        'label': group['label'],
+        'trials': len(x),
+        'threshold': threshold,
+        'threshold_low': threshold_ci[0],
+        'threshold_high': threshold_ci[1],
+        'beta': beta,
+        'beta_low': beta_ci[0],
+        'beta_high': beta_ci[1],
+        'radius': threshold * group['filter_radius'],
+        'radius_low': threshold_ci[0] * group['filter_radius'],
+        'radius_high': threshold_ci[1] * group['filter_radius'],
+        'last_radius': x[-1] * group['filter_radius'],
+        'at_edge': bool(at_edge),
+        'edge_samples': int(edges.sum())
+    }
+
+
+def fit_groups(groups, n_samples, confidence, free_beta, seeds):
+    return [
+        fit_group(g, n_samples, confidence, free_beta, s)
+        for g, s in zip(groups, seeds)
+    ]
+
+
+def split_groups(data):
+    groups = statistics.Groups(data)
+    # the quests store 'correct' for seeing the artifact, their psychometric
+    # function is the probability of the other response
+    series = zip(groups.series(data['intensity']),
+                 groups.series(1 - data['correct'].astype(np.float64)))
+    last = {
+        k: groups.last(data[k])
+        for k in ('beta', 'delta', 'gamma', 'pThreshold', 'filter_radius')
+    }
+    return [{
+        'user': str(user),
+        'label': str(label),
+        'intensity': x,
+        'response': y,
+        **{k: float(v[i]) for k, v in last.items()}
+    } for i, (user, label, (x, y)) in enumerate(
+        zip(groups.values('user'), groups.values('label'), series))]
+
+
+def fit_all(data, n_samples=1000, confidence=95.0, free_beta=False,
+            seed=None, workers=None, chunk_size=16):
+    groups = split_groups(data)
+    seeds = np.random.SeedSequence(seed).spawn(len(groups))
+    chunks = [(groups[i:i + chunk_size], seeds[i:i + chunk_size])
+              for i in range(0, len(groups), chunk_size)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return fit_groups(groups, n_samples, confidence, free_beta, seeds)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(fit_groups, g, n_samples, confidence, free_beta,
+                            s)
+            for g, s in chunks
+        ]
+        return [r for f in futures for r in f.result()]
+
+
+def print_results(results):
+    width = max([5] + [len(r['label']) for r in results])
+    print(f'{"user":6} {"label":{width}} {"trials":>6} {"radius":>8} '
+          f'{"ci":>17} {"beta":>7} {"last":>8} {"edge":>6}')
+    for r in results:
+        ci = f'[{r["radius_low"]:7.2f} {r["radius_high"]:7.2f}]'
+        # * marks a fit whose maximum lies on the edge of the grid
+        edge = ('*' if r['at_edge'] else '') + str(r['edge_samples'])
+        print(f'{r["user"]:6} {r["label"]:{width}} {r["trials"]:6d} '
+              f'{r["radius"]:8.2f} {ci:>17} {r["beta"]:7.2f} '
+              f'{r["last_radius"]:8.2f} {edge:>6}')
+
+
+def write_csv(filename, results):
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fit psychometric functions with bootstrap confidence '
+        'intervals per user and condition.')
+    parser.add_argument('files',
+                        nargs='*',
+                        default=sorted(glob.glob(os.path.join('data',
+                                                              '*.csv'))))
+    parser.add_argument('--samples',
+                        type=int,
+                        default=1000,
+                        help='Number of bootstrap samples.')
+    parser.add_argument('--confidence', type=float, default=95.0)
+    parser.add_argument('--free-beta',
+                        action='store_true',
+                        help='Fit the slope instead of using the beta of the '
+                        'condition.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--user', help='Fit a single user.')
+    parser.add_argument('--csv', help='Write the results into a CSV file.')
+    args = parser.parse_args(sys.argv[1:])
+
+    table = csv2np.load(args.files, cache=True)
+    data = table[table['is_reference'] == False]
+    if args.user:
+        data = data[data['user'] == args.user]
+
+    start = time.time()
+    results = fit_all(data, args.samples, args.confidence, args.free_beta,
+                      args.seed, args.workers)
+    print_results(results)
+    print(f'{len(results)} fits with {args.samples} bootstrap samples in '
+          f'{time.time() - start:.1f} s')
+    if args.csv:
+        write_csv(args.csv, results)
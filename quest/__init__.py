@@ -1 +1,2 @@
-from .randomize_quests import MultiQuest
\ No newline at end of file
+from .randomize_quests import MultiQuest
+from .posterior import Quest, QuestPosterior, proposed_intensities
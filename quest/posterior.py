@@ -0,0 +1,316 @@
+import math
+import numpy as np
+
+
+class QuestPosterior:
+    def __init__(self, conditions):
+        n_rows = len(conditions)
+        self.t_guess = np.zeros(n_rows)
+        self.t_guess_sd = np.zeros(n_rows)
+        self.grain = np.zeros(n_rows)
+        self.dim = np.zeros(n_rows, np.int64)
+        self.quantile_order = np.zeros(n_rows)
+        self.x_threshold = np.zeros(n_rows)
+        for row, condition in enumerate(conditions):
+            grain = float(condition.get('grain', 0.01))
+            intensity_range = condition.get('range', None)
+            if intensity_range is None:
+                dim = 500
+            elif intensity_range <= 0:
+                raise ValueError('argument "range" must be greater than zero.')
+            else:
+                dim = 2 * math.ceil(intensity_range / grain / 2.0)
+            self.t_guess[row] = condition['startVal']
+            self.t_guess_sd[row] = condition['startValSd']
+            self.grain[row] = grain
+            self.dim[row] = dim
+
+        width = int(self.dim.max(initial=0)) + 1
+        self.x = np.zeros((n_rows, width))
+        self.pdf = np.zeros((n_rows, width))
+        self.p2 = np.zeros((n_rows, 2 * width - 1))
+        for row, condition in enumerate(conditions):
+            self._init_row(row, condition.get('pThreshold', 0.82),
+                           condition.get('beta', 3.5),
+                           condition.get('delta', 0.01),
+                           condition.get('gamma', 0.5))
+
+    def _init_row(self, row, p_threshold, beta, delta, gamma):
+        # same tables as psychopy.contrib.quest.QuestObject.recompute
+        if gamma > p_threshold:
+            gamma = 0.5
+        dim, grain = int(self.dim[row]), self.grain[row]
+        x = np.arange(-dim / 2, dim / 2 + 1) * grain
+        pdf = np.exp(-0.5 * (x / self.t_guess_sd[row])**2)
+        x2 = np.arange(-dim, dim + 1) * grain
+        p2 = delta * gamma + (1 - delta) * (1 - (1 - gamma) * np.exp(-10**
+                                                                   (beta * x2)))
+        if p2[0] >= p_threshold or p2[-1] <= p_threshold:
+            raise RuntimeError(
+                f'psychometric function range [{p2[0]:.2f} {p2[-1]:.2f}] '
+                f'omits {p_threshold:.2f} threshold')
+        index = np.nonzero(p2[1:] - p2[:-1])[0]
+        x_threshold = np.interp([p_threshold], p2[index], x2[index])[0]
+        p2 = delta * gamma + (1 - delta) * (1 - (1 - gamma) * np.exp(
+            -10**(beta * (x2 + x_threshold))))
+
+        eps = 1e-14
+        p_low, p_high = p2[0], p2[-1]
+        p_e = (p_high * math.log(p_high + eps) -
+               p_low * math.log(p_low + eps) +
+               (1 - p_high + eps) * math.log(1 - p_high + eps) -
+               (1 - p_low + eps) * math.log(1 - p_low + eps))
+        p_e = 1 / (1 + math.exp(p_e / (p_low - p_high)))
+
+        self.x[row, :dim + 1] = x
+        self.pdf[row, :dim + 1] = pdf / np.sum(pdf)
+        self.p2[row, :2 * dim + 1] = p2
+        self.x_threshold[row] = x_threshold
+        self.quantile_order[row] = (p_e - p_low) / (p_high - p_low)
+
+    def __len__(self):
+        return self.pdf.shape[0]
+
+    def take(self, rows):
+        rows = np.atleast_1d(rows)
+        posterior = QuestPosterior.__new__(QuestPosterior)
+        for key, value in self.__dict__.items():
+            setattr(posterior, key, value[rows].copy())
+        return posterior
+
+    def update(self, rows, intensities, responses):
+        rows = np.atleast_1d(rows)
+        intensities = np.clip(np.asarray(intensities, np.float64), -1e10, 1e10)
+        responses = np.atleast_1d(responses).astype(bool)
+        half_dim = self.dim[rows] // 2
+        k = np.round((intensities - self.t_guess[rows]) / self.grain[rows])
+        k = np.clip(k.astype(np.int64), -half_dim, half_dim)
+        index = (3 * half_dim + k)[:, None] - np.arange(self.pdf.shape[1])
+        index = np.clip(index, 0, self.p2.shape[1] - 1)
+        p = np.take_along_axis(self.p2[rows], index, axis=1)
+        likelihood = np.where(responses[:, None], p, 1 - p)
+        np.multiply.at(self.pdf, rows, likelihood)
+
+    def _sum(self, values, rows):
+        # sum every row over its own grid, so the rounding matches psychopy
+        dim = self.dim[rows]
+        if np.all(dim == self.pdf.shape[1] - 1):
+            return np.sum(values, axis=-1)
+        sums = [
+            np.sum(v[:d + 1])
+            for v, d in zip(np.atleast_2d(values), np.atleast_1d(dim))
+        ]
+        return np.reshape(sums, np.shape(dim))
+
+    def mean(self, rows=None):
+        rows = slice(None) if rows is None else rows
+        pdf = self.pdf[rows]
+        return self.t_guess[rows] + self._sum(pdf * self.x[rows],
+                                              rows) / self._sum(pdf, rows)
+
+    def sd(self, rows=None):
+        rows = slice(None) if rows is None else rows
+        pdf, x = self.pdf[rows], self.x[rows]
+        p = self._sum(pdf, rows)
+        return np.sqrt(
+            self._sum(pdf * x**2, rows) / p - (self._sum(pdf * x, rows) / p)**2)
+
+    def mode(self, rows=None):
+        rows = slice(None) if rows is None else rows
+        pdf = self.pdf[rows]
+        index = np.argsort(pdf, axis=-1)[..., -1:]
+        return (np.take_along_axis(self.x[rows], index, axis=-1)[..., 0] +
+                self.t_guess[rows])
+
+    def quantile(self, rows=None, quantile_order=None):
+        rows = np.arange(len(self)) if rows is None else rows
+        is_scalar = np.ndim(rows) == 0
+        rows = np.atleast_1d(rows)
+        result = np.zeros(len(rows))
+        for i, row in enumerate(rows):
+            # np.interp over the nonzero pdf entries, as in psychopy
+            dim = int(self.dim[row])
+            p = np.cumsum(self.pdf[row, :dim + 1])
+            if not np.isfinite(p[-1]):
+                raise RuntimeError('pdf is not finite')
+            if p[-1] == 0:
+                raise RuntimeError('pdf is all zero')
+            index = np.nonzero(np.diff(np.concatenate(([-1], p))))[0]
+            if len(index) < 2:
+                raise RuntimeError(
+                    f'pdf has only {len(index)} nonzero point(s)')
+            order = (self.quantile_order[row]
+                     if quantile_order is None else quantile_order)
+            result[i] = self.t_guess[row] + np.interp(
+                [order * p[-1]], p[index], self.x[row, index])[0]
+        return result[0] if is_scalar else result
+
+
+class Quest:
+    def __init__(self,
+                 posterior,
+                 row,
+                 startVal,
+                 nTrials=None,
+                 stopInterval=None,
+                 method='quantile',
+                 minVal=None,
+                 maxVal=None,
+                 **kwargs):
+        if method not in ('quantile', 'mean', 'mode'):
+            raise TypeError(f'Requested method for QUEST: {method} is not a '
+                            'valid method. Please use mean, mode or quantile')
+        self._posterior = posterior
+        self._row = row
+        self.startVal = startVal
+        self.nTrials = nTrials
+        self.stopInterval = stopInterval
+        self.method = method
+        self.minVal = minVal
+        self.maxVal = maxVal
+        self.finished = False
+        self.thisTrialN = -1
+        self.otherData = {}
+        self.data = []
+        self.intensities = []
+        self._nextIntensity = startVal
+        self._questNextIntensity = startVal
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        self.thisTrialN += 1
+        self.intensities.append(self._nextIntensity)
+        return self._nextIntensity
+
+    next = __next__
+
+    @property
+    def posterior(self):
+        return self._posterior
+
+    @property
+    def row(self):
+        return self._row
+
+    @property
+    def pdf(self):
+        return self._posterior.pdf[self._row]
+
+    def addResponse(self, result, intensity=None):
+        if intensity is None:
+            intensity = self._questNextIntensity
+        else:
+            if len(self.intensities) != 0:
+                self.intensities.pop()
+            self.intensities.append(intensity)
+        self._posterior.update(self._row, intensity, result)
+        self.data.append(result)
+        self._checkFinished()
+        if not self.finished:
+            self.calculateNextIntensity()
+
+    def addOtherData(self, dataName, value):
+        if dataName not in self.otherData:
+            if self.thisTrialN > 0:
+                self.otherData[dataName] = [None] * (self.thisTrialN - 1)
+            else:
+                self.otherData[dataName] = []
+        self.otherData[dataName].append(value)
+
+    def calculateNextIntensity(self):
+        if self.method == 'mean':
+            intensity = self.mean()
+        elif self.method == 'mode':
+            intensity = self.mode()
+        else:
+            intensity = self.quantile()
+        if self.maxVal is not None and intensity > self.maxVal:
+            intensity = self.maxVal
+        elif self.minVal is not None and intensity < self.minVal:
+            intensity = self.minVal
+        self._nextIntensity = intensity
+        self._questNextIntensity = intensity
+
+    def _checkFinished(self):
+        if self.nTrials is not None and len(self.intensities) >= self.nTrials:
+            self.finished = True
+        elif (self.stopInterval is not None and
+              self.confInterval(True) < self.stopInterval):
+            self.finished = True
+        else:
+            self.finished = False
+
+    def mean(self):
+        return float(self._posterior.mean(self._row))
+
+    def sd(self):
+        return float(self._posterior.sd(self._row))
+
+    def mode(self):
+        return float(self._posterior.mode(self._row))
+
+    def quantile(self, p=None):
+        return float(self._posterior.quantile(self._row, p))
+
+    def confInterval(self, getDifference=False):
+        interval = [self.quantile(0.05), self.quantile(0.95)]
+        if getDifference:
+            return abs(interval[0] - interval[1])
+        return interval
+
+    def copy(self):
+        quest = Quest.__new__(Quest)
+        quest.__dict__.update(self.__dict__)
+        quest._posterior = self._posterior.take(self._row)
+        quest._row = 0
+        quest.intensities = list(self.intensities)
+        quest.data = list(self.data)
+        quest.otherData = {k: list(v) for k, v in self.otherData.items()}
+        return quest
+
+    def get_state(self):
+        return (len(self.intensities), len(self.data),
+                {k: len(v) for k, v in self.otherData.items()},
+                self.thisTrialN, self.finished, self._nextIntensity,
+                self._questNextIntensity, self.pdf.copy())
+
+    def set_state(self, state):
+        (n_intensities, n_data, n_other_data, self.thisTrialN, self.finished,
+         self._nextIntensity, self._questNextIntensity, pdf) = state
+        del self.intensities[n_intensities:]
+        del self.data[n_data:]
+        for key in list(self.otherData):
+            if key in n_other_data:
+                del self.otherData[key][n_other_data[key]:]
+            else:
+                del self.otherData[key]
+        self._posterior.pdf[self._row] = pdf
+
+
+def proposed_intensities(conditions, max_responses):
+    # (condition, intensity) of every intensity a fresh quest proposes after
+    # 0 to max_responses responses, for any sequence of responses, in the
+    # order the study can reach them
+    posterior = QuestPosterior(conditions)
+    frontiers = [[Quest(posterior.take(row), 0, **condition)]
+                 for row, condition in enumerate(conditions)]
+    result = []
+    for _ in range(max_responses + 1):
+        for condition, frontier in zip(conditions, frontiers):
+            intensities = {quest._nextIntensity for quest in frontier}
+            result.extend((condition, i) for i in sorted(intensities))
+        for row, frontier in enumerate(frontiers):
+            children = []
+            for quest in frontier:
+                for response in (0, 1):
+                    child = quest.copy()
+                    child.next()
+                    child.addResponse(response)
+                    if not child.finished:
+                        children.append(child)
+            frontiers[row] = children
+    return result
@@ -1,13 +1,116 @@
+import atexit
+import collections
 import contextlib
 import copy
 import enum
 import glob
 import itertools
+import json
 import numpy as np
 import os
 import pickle
-from psychopy.data import QuestHandler
+import queue
+import threading
 import time
+from .posterior import Quest, QuestPosterior
+
+
+def _quest_state(quest):
+    if hasattr(quest, 'get_state'):
+        return quest.get_state()
+    state = {}
+    for key, value in quest.__dict__.items():
+        if isinstance(value, list):
+            state[key] = (list, len(value))
+        elif key == 'otherData':
+            state[key] = (dict, {k: len(v) for k, v in value.items()})
+        else:
+            state[key] = (None, copy.deepcopy(value))
+    return state
+
+
+def _restore_quest_state(quest, state):
+    if hasattr(quest, 'set_state'):
+        quest.set_state(state)
+        return
+    for key in set(quest.__dict__) - set(state):
+        delattr(quest, key)
+    for key, (kind, value) in state.items():
+        if kind is list:
+            del getattr(quest, key)[value:]
+        elif kind is dict:
+            other_data = getattr(quest, key)
+            for k in list(other_data):
+                if k in value:
+                    del other_data[k][value[k]:]
+                else:
+                    del other_data[k]
+        else:
+            setattr(quest, key, value)
+
+
+class JournalWriter:
+    def __init__(self, filename):
+        self._filename = filename
+        self._queue = queue.Queue()
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, lines):
+        self._put(('append', lines))
+
+    def write_file(self, filename, data):
+        self._put(('file', filename, data))
+
+    def flush(self):
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        atexit.unregister(self.close)
+        self._raise_error()
+
+    def _put(self, job):
+        self._raise_error()
+        if self._closed:
+            raise ValueError('The journal writer is closed.')
+        self._queue.put(job)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        with open(self._filename, 'a') as journal:
+            while True:
+                job = self._queue.get()
+                try:
+                    if job is None:
+                        return
+                    if job[0] == 'append':
+                        journal.writelines(job[1])
+                        journal.flush()
+                        os.fsync(journal.fileno())
+                    else:
+                        _, filename, data = job
+                        with open(f'{filename}.tmp', 'wb') as file_handle:
+                            file_handle.write(data)
+                            file_handle.flush()
+                            os.fsync(file_handle.fileno())
+                        os.replace(f'{filename}.tmp', filename)
+                except OSError as error:
+                    self._error = error
+                finally:
+                    self._queue.task_done()
 
 
 class Response(enum.Enum):
@@ -18,14 +121,36 @@ class Response(enum.Enum):
 
 
 class MultiQuest:
+    _response_methods = {
+        Response.SAW_ARTIFACT.name: 'saw_artifact_response',
+        Response.SAW_LINE.name: 'saw_line_response',
+        Response.CANNOT_DECIDE.name: 'cannot_decide_response'
+    }
+    _transient_keys = ('_journal', '_journal_records', '_replaying',
+                       '_undo_stack', '_undo_trial', '_pending_undos')
+
     def __init__(self,
                  user,
                  conditions,
                  random_reference_probability=0.0,
+                 snapshot_interval=100,
+                 undo_depth=100,
+                 persistent=True,
+                 seed=None,
+                 stimulus_cache=False,
                  **kwargs):
+        self._random = np.random.RandomState(seed)
+        # cached static stimuli are drawn on the grain grid of their quest, so
+        # their intensity is snapped before it is shown and learned from
+        self._snap_static_intensities = bool(stimulus_cache)
+        self._shown_intensity = None
         self._user = user
         self._conditions = conditions
-        self._quests = [QuestHandler(**condition) for condition in conditions]
+        self._posterior = QuestPosterior(conditions)
+        self._quests = [
+            Quest(self._posterior, row, **condition)
+            for row, condition in enumerate(conditions)
+        ]
         self._quest_labels = [condition['label'] for condition in conditions]
         self._random_reference_trials = None
         self._random_reference_probability = random_reference_probability
@@ -34,73 +159,151 @@ class MultiQuest:
         self._max_active_quest_history = 0
         self._active_quest_index = self._random_quest_index()
         self._is_reference = self._random_reference_decision
-        self._reference_quest = copy.deepcopy(self._active_quest)
+        self._reference_quest = self._active_quest.copy()
         self._trial_counter = 0
         self._quest_changes = 0
         self._quest_changed = False
         self._start_time = time.time()
         self._previous_response = Response.NONE
-
-        self._init_output_folder(user)
-        self._load_backup()
-
-    def saw_artifact_response(self, duration, selection, x, y):
+        self._n_responses = 0
+        self._snapshot_interval = snapshot_interval
+        self._snapshot_responses = 0
+        self._undo_depth = undo_depth
+        self._persistent = persistent
+
+        self._journal = None
+        self._journal_records = 0
+        self._replaying = False
+        self._undo_stack = collections.deque(maxlen=undo_depth)
+        self._undo_trial = None
+        self._pending_undos = 0
+        if persistent:
+            self._init_output_folder(user)
+            self._recover()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in self._transient_keys:
+            state.pop(key, None)
+        return state
+
+    def saw_artifact_response(self, duration, selection, x, y, timing=None):
         self._previous_response = Response.SAW_ARTIFACT
         self._add_response_info_to_current_quest(duration=duration,
                                                  saw_artifact=True,
                                                  selection=selection,
                                                  x=x,
-                                                 y=y)
-        self._save_backup()
+                                                 y=y,
+                                                 timing=timing)
+        self._save_backup(Response.SAW_ARTIFACT, duration, selection, x, y,
+                          *self._timing_args(timing))
 
-    def saw_line_response(self, duration):
+    def saw_line_response(self, duration, timing=None):
         self._previous_response = Response.SAW_LINE
         self._add_response_info_to_current_quest(duration=duration,
                                                  saw_artifact=False,
                                                  selection='none',
                                                  x='',
-                                                 y='')
-        self._save_backup()
+                                                 y='',
+                                                 timing=timing)
+        self._save_backup(Response.SAW_LINE, duration,
+                          *self._timing_args(timing))
 
-    def cannot_decide_response(self, duration):
+    def cannot_decide_response(self, duration, timing=None):
         self._previous_response = Response.CANNOT_DECIDE
         self._add_response_info_to_current_quest(duration=duration,
                                                  saw_artifact=False,
                                                  selection='none',
                                                  x='',
-                                                 y='')
-        self._save_backup()
+                                                 y='',
+                                                 timing=timing)
+        self._save_backup(Response.CANNOT_DECIDE, duration,
+                          *self._timing_args(timing))
+
+    @staticmethod
+    def _timing_args(timing):
+        # old journals have no timing argument
+        return () if timing is None else (timing, )
 
     def undo(self):
-        self._load_backup(-1)
+        if self._n_responses == 0:
+            return
+        if self._undo_trial is not None:
+            self._restore_undo_entry(self._undo_trial)
+            self._undo_trial = None
+        if len(self._undo_stack) == 0:
+            if not self._persistent:
+                return
+            self._append_journal({'undo': True})
+            self._recover()
+            return
+        self._restore_undo_entry(self._undo_stack.pop())
+        # the undo is written with the next journal record
+        self._pending_undos += 1
 
     def next(self):
+        if self._undo_trial is None:
+            self._undo_trial = (self._undo_attributes(),
+                                self._random.get_state(), {})
         if not self._next_trial():
             raise StopIteration
+        quests = self._undo_trial[2]
+        for quest in (self._quest, self._active_quest):
+            if id(quest) not in quests:
+                quests[id(quest)] = (quest, _quest_state(quest))
         intensity = self._quest.next()
         condition = self._active_condition
+        self._shown_intensity = None
+        if self._snap_static_intensities and condition['velocity'] == 0:
+            grain = condition.get('grain', 0.01)
+            intensity = round(intensity / grain) * grain
+            self._shown_intensity = intensity
         return intensity, condition
 
-    def save(self):
-        self._save_csv(os.path.join(self._data_folder, 'result.csv'))
+    def save(self, npz=False):
+        if self._pending_undos:
+            self._append_journal()
+        if self._journal is not None:
+            self._journal.flush()
+        self._save_csv(os.path.join(self._data_folder, 'result.csv'), npz)
+
+    def _save_csv(self, filename, npz=False):
+        results = self._quest_results()
+        keys = sorted(set(itertools.chain.from_iterable(results)))
+        columns = {key: [] for key in keys} if npz else None
 
-    def _save_csv(self, filename):
         self._backup_file(filename)
         with open(filename, 'w') as file:
-            results = self._quest_results()
-            keys = sorted(set(itertools.chain.from_iterable(results)))
-
             file.write(','.join(keys) + '\n')
             for result in results:
-                try:
-                    while True:
-                        row = [
-                            str(result[key].pop(0)) if key in result else ''
-                            for key in keys
-                        ]
-                        file.write(','.join(row) + '\n')
-                except IndexError:
-                    pass
+                # columns added during a session (e.g. the timing of
+                # sessions resumed from legacy pickles) miss their first rows
+                n_rows = max(len(v) for v in result.values())
+                result_columns = [
+                    [''] * (n_rows - len(column)) +
+                    ['' if v is None else v for v in column]
+                    for column in (result.get(key, []) for key in keys)
+                ]
+                for i in range(n_rows):
+                    file.write(','.join(str(c[i]) for c in result_columns) +
+                               '\n')
+                if columns is not None:
+                    for key, column in zip(keys, result_columns):
+                        columns[key].extend(column)
+
+        if columns is not None:
+            self._save_npz(os.path.splitext(filename)[0] + '.npz', columns)
+
+    def _save_npz(self, filename, columns):
+        arrays = {}
+        for key, column in columns.items():
+            array = np.asarray(column)
+            if array.dtype == object:
+                array = np.asarray([str(v) for v in column])
+            arrays[key] = array
+        self._backup_file(filename)
+        with open(filename, 'wb') as file:
+            np.savez(file, **arrays)
 
     def _quest_result(self, label, condition, quest):
         n_values = max([0] + [len(v) for v in quest.otherData.values()])
@@ -116,7 +319,7 @@ class MultiQuest:
         ]
 
     def _random_quest_index(self):
-        return np.random.randint(len(self._quests))
+        return self._random.randint(len(self._quests))
 
     @property
     def _random_reference_decision(self):
@@ -124,14 +327,16 @@ class MultiQuest:
             n = 20
             s = int(n * (1.0 - self._random_reference_probability))
             t = int(n * self._random_reference_probability)
-            a = np.zeros((s + t,), np.bool)
+            a = np.zeros((s + t,), bool)
             a[:t] = True
-            self._random_reference_trials = np.random.permutation(a).tolist()
+            self._random_reference_trials = self._random.permutation(a).tolist()
         return self._random_reference_trials.pop() == 1
 
-    def _add_response_info_to_current_quest(self, duration, saw_artifact, selection, x, y):
+    def _add_response_info_to_current_quest(self, duration, saw_artifact, selection, x, y, timing=None):
         quest = self._quest
         intensity = quest.intensities[-1]
+        if self._shown_intensity is not None:
+            intensity = self._shown_intensity
         change = 'increase' if saw_artifact else 'decrease'
         if self._is_reference:
             correct = False if saw_artifact else True
@@ -150,11 +355,14 @@ class MultiQuest:
         active.addOtherData('y', y)
         active.addOtherData('is_reference', self._is_reference)
         active.addOtherData('duration', duration)
+        # frame timing and noise seed of the trial, see Study.trial_info
+        for key, value in (timing or {}).items():
+            active.addOtherData(key, value)
 
         if change == 'increase':
-            quest.addResponse(0)
+            quest.addResponse(0, self._shown_intensity)
         elif change == 'decrease':
-            quest.addResponse(1)
+            quest.addResponse(1, self._shown_intensity)
 
     def _next_trial(self):
         self._trial_counter += 1
@@ -164,7 +372,7 @@ class MultiQuest:
             self._quest_changes += 1
             self._next_quest_index()
             if self._is_reference and self._has_active_quest:
-                self._reference_quest = copy.deepcopy(self._active_quest)
+                self._reference_quest = self._active_quest.copy()
             else:
                 self._reference_quest = None
         else:
@@ -187,7 +395,7 @@ class MultiQuest:
             with contextlib.suppress(ValueError, AttributeError):
                 for i in self._active_quest_history:
                     indices.remove(i)
-        return np.random.choice(indices)
+        return self._random.choice(indices)
 
     def _init_output_folder(self, user=None):
         self._data_folder = os.path.join(os.path.dirname(__file__), 'data')
@@ -199,32 +407,139 @@ class MultiQuest:
         self._data_folder = os.path.join(self._data_folder, user)
         os.makedirs(self._data_folder, exist_ok=True)
 
-    def _load_backup(self, undo=0):
-        n_backups = len(glob.glob(os.path.join(self._data_folder, '*.pickle')))
-        if n_backups == 0:
-            return False
-
-        backup = max(1, n_backups - abs(undo))
-
-        for i in range(backup+1, n_backups+1):
-            src = os.path.join(self._data_folder, f'{i}.pickle')
-            self._backup_file(src)
+    @property
+    def _journal_file(self):
+        return os.path.join(self._data_folder, 'journal.jsonl')
+
+    def _snapshot_file(self, snapshot_id):
+        return os.path.join(self._data_folder, f'snapshot-{snapshot_id}.pickle')
+
+    def close(self):
+        if self._pending_undos:
+            self._append_journal()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _append_journal(self, *records):
+        records = [{'undo': True}] * self._pending_undos + list(records)
+        self._pending_undos = 0
+        if self._journal is None:
+            self._journal = JournalWriter(self._journal_file)
+        self._journal.append(
+            [json.dumps(record, default=float) + '\n' for record in records])
+        self._journal_records += len(records)
+
+    def _undo_attributes(self):
+        return {
+            k: copy.copy(v) if isinstance(v, list) else v
+            for k, v in self.__dict__.items()
+            if k not in self._transient_keys and k != '_random'
+        }
+
+    def _restore_undo_entry(self, entry):
+        attributes, random_state, quests = entry
+        for quest, state in quests.values():
+            _restore_quest_state(quest, state)
+        self.__dict__.update(attributes)
+        self._random.set_state(random_state)
+
+    def _read_journal(self):
+        if not os.path.exists(self._journal_file):
+            return []
+        records = []
+        offset = 0
+        with open(self._journal_file, 'rb') as file_handle:
+            for line in file_handle:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                offset += len(line)
+        # drop a record that was torn by a crash while it was written
+        if offset != os.path.getsize(self._journal_file):
+            with open(self._journal_file, 'r+b') as file_handle:
+                file_handle.truncate(offset)
+        return records
+
+    def _recover(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        records = self._read_journal()
+        self._journal_records = len(records)
+        if len(records) == 0:
+            self._load_legacy_backup()
+            self._save_snapshot()
+            return
 
-        filename = os.path.join(self._data_folder, f'{backup}.pickle')
+        responses = []
+        snapshots = []
+        for record in records:
+            if 'response' in record:
+                responses.append(record)
+            elif 'undo' in record:
+                if len(responses):
+                    responses.pop()
+                snapshots = [
+                    s for s in snapshots if s['responses'] <= len(responses)
+                ]
+            elif 'snapshot' in record:
+                snapshots.append(record)
+
+        snapshot = snapshots[-1]
+        with open(self._snapshot_file(snapshot['snapshot']), 'rb') as file_handle:
+            backup = pickle.load(file_handle)
+        for key, value in backup.__dict__.items():
+            setattr(self, key, value)
+
+        self._undo_stack = collections.deque(maxlen=self._undo_depth)
+        self._undo_trial = None
+        self._replaying = True
+        try:
+            for record in responses[snapshot['responses']:]:
+                self.next()
+                getattr(self, self._response_methods[record['response']])(
+                    *record['args'])
+        finally:
+            self._replaying = False
+
+    def _load_legacy_backup(self):
+        backups = glob.glob(os.path.join(self._data_folder, '[0-9]*.pickle'))
+        if len(backups) == 0:
+            return False
+        filename = max(backups,
+                       key=lambda f: int(os.path.basename(f).split('.')[0]))
         with open(filename, 'rb') as file_handle:
             backup = pickle.load(file_handle)
-
-        for key in self.__dict__.keys():
-            setattr(self, key, getattr(backup, key))
-
+        for key, value in backup.__dict__.items():
+            setattr(self, key, value)
         return True
 
-    def _save_backup(self):
-        n_backups = len(glob.glob(os.path.join(self._data_folder, '*.pickle')))
-        filename = os.path.join(self._data_folder, f'{n_backups + 1}.pickle')
-        self._backup_file(filename)
-        with open(filename, 'wb') as file_handle:
-            pickle.dump(self, file_handle, protocol=pickle.HIGHEST_PROTOCOL)
+    def _save_backup(self, response, *args):
+        self._n_responses += 1
+        if self._undo_trial is not None:
+            self._undo_stack.append(self._undo_trial)
+            self._undo_trial = None
+        if self._replaying or not self._persistent:
+            return
+        self._append_journal({'response': response.name, 'args': args})
+        if self._n_responses - self._snapshot_responses >= self._snapshot_interval:
+            self._save_snapshot()
+
+    def _save_snapshot(self):
+        snapshot_id = self._journal_records
+        self._snapshot_responses = self._n_responses
+        data = pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._journal is None:
+            self._journal = JournalWriter(self._journal_file)
+        self._journal.write_file(self._snapshot_file(snapshot_id), data)
+        self._append_journal({
+            'snapshot': snapshot_id,
+            'responses': self._n_responses
+        })
 
     def _backup_file(self, filename):
         if os.path.exists(filename):
@@ -234,6 +549,10 @@ class MultiQuest:
             os.rename(filename, dst)
             return dst
 
+    @property
+    def quests(self):
+        return self._quests
+
     @property
     def is_reference(self):
         return self._is_reference
@@ -0,0 +1,221 @@
+import argparse
+import concurrent.futures
+import csv
+import math
+import os
+import sys
+import numpy as np
+import quest
+
+
+class Observer:
+    def __init__(self, threshold, p_threshold=0.82, beta=3.5, delta=0.01,
+                 gamma=0.5):
+        if gamma > p_threshold:
+            gamma = 0.5
+        self.threshold = threshold
+        self.beta = beta
+        self.delta = delta
+        self.gamma = gamma
+        # same psychometric function as the quest, shifted so that
+        # p(threshold) == p_threshold
+        q = (1 - (p_threshold - delta * gamma) / (1 - delta)) / (1 - gamma)
+        self._x_threshold = math.log10(-math.log(q)) / beta
+
+    def p_saw_line(self, intensity):
+        x = intensity - self.threshold + self._x_threshold
+        return self.delta * self.gamma + (1 - self.delta) * (
+            1 - (1 - self.gamma) * math.exp(-10**(self.beta * x)))
+
+    def saw_line(self, intensity, is_reference, random):
+        if is_reference:
+            return random.random_sample() >= self.delta * self.gamma
+        return random.random_sample() < self.p_saw_line(intensity)
+
+
+def observers(conditions, threshold=None, threshold_sd=0.0, beta=None,
+              delta=None, random=None):
+    result = []
+    for c in conditions:
+        t = c['startVal'] if threshold is None else threshold
+        if threshold_sd > 0:
+            t += random.normal(0.0, threshold_sd)
+        result.append(
+            Observer(t, c.get('pThreshold', 0.82),
+                     c.get('beta', 3.5) if beta is None else beta,
+                     c.get('delta', 0.01) if delta is None else delta,
+                     c.get('gamma', 0.5)))
+    return result
+
+
+def converged_after(estimates, threshold, tolerance):
+    # number of responses after which the estimate stays within tolerance
+    error = np.abs(np.asarray(estimates) - threshold) > tolerance
+    outside = np.nonzero(error)[0]
+    if len(outside) == 0:
+        return 0
+    if outside[-1] == len(estimates) - 1:
+        return -1
+    return int(outside[-1]) + 1
+
+
+def simulate_session(session, conditions, settings, observer_settings,
+                     tolerance, seed):
+    random = np.random.RandomState(seed)
+    quests = quest.MultiQuest(f'simulation-{session}',
+                              conditions,
+                              persistent=False,
+                              seed=random.randint(2**31),
+                              **settings)
+    session_observers = observers(conditions, random=random,
+                                  **observer_settings)
+    estimates = [[] for _ in conditions]
+    index = {id(c): i for i, c in enumerate(conditions)}
+    while True:
+        try:
+            intensity, condition = quests.next()
+        except StopIteration:
+            break
+        i = index[id(condition)]
+        is_reference = quests.is_reference
+        if session_observers[i].saw_line(intensity, is_reference, random):
+            quests.saw_line_response(0.0)
+        else:
+            quests.saw_artifact_response(0.0, 'simulation', 0, 0)
+        if not is_reference:
+            estimates[i].append(quests.quests[i].mean())
+
+    results = []
+    for c, o, q, e in zip(conditions, session_observers, quests.quests,
+                          estimates):
+        final = q.mean()
+        results.append({
+            'session': session,
+            'label': c['label'],
+            'threshold': o.threshold,
+            'estimate': final,
+            'error': final - o.threshold,
+            'trials': len(q.data),
+            'converged_after': converged_after(e, o.threshold, tolerance),
+            'ci': q.confInterval(True)
+        })
+    return results
+
+
+def simulate_sessions(sessions, *args):
+    return [r for s, seed in sessions for r in simulate_session(s, *args, seed)]
+
+
+def simulate(conditions, settings, n_sessions, observer_settings=None,
+             tolerance=0.05, seed=None, workers=None, chunk_size=16):
+    seeds = np.random.SeedSequence(seed).generate_state(n_sessions)
+    sessions = list(enumerate(int(s) for s in seeds))
+    chunks = [
+        sessions[i:i + chunk_size]
+        for i in range(0, len(sessions), chunk_size)
+    ]
+    args = (conditions, settings, observer_settings or {}, tolerance)
+    if workers == 1:
+        return [r for c in chunks for r in simulate_sessions(c, *args)]
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(simulate_sessions, c, *args) for c in chunks]
+        return [r for f in futures for r in f.result()]
+
+
+def summarize(results):
+    labels = list(dict.fromkeys(r['label'] for r in results))
+    summary = []
+    for label in labels:
+        rs = [r for r in results if r['label'] == label]
+        error = np.array([r['error'] for r in rs])
+        trials = np.array([r['trials'] for r in rs])
+        converged = np.array([r['converged_after'] for r in rs])
+        summary.append({
+            'label': label,
+            'sessions': len(rs),
+            'bias': float(np.mean(error)),
+            'sd': float(np.std(error)),
+            'rmse': float(np.sqrt(np.mean(error**2))),
+            'trials': float(np.mean(trials)),
+            'converged_after': (float(np.median(converged[converged >= 0]))
+                                if np.any(converged >= 0) else math.nan),
+            'not_converged': float(np.mean(converged < 0))
+        })
+    return summary
+
+
+def print_summary(summary):
+    width = max([5] + [len(s['label']) for s in summary])
+    print(f'{"label":{width}} {"sessions":>8} {"bias":>8} {"sd":>8} '
+          f'{"rmse":>8} {"trials":>7} {"converged":>9} {"failed":>7}')
+    for s in summary:
+        print(f'{s["label"]:{width}} {s["sessions"]:8d} {s["bias"]:8.4f} '
+              f'{s["sd"]:8.4f} {s["rmse"]:8.4f} {s["trials"]:7.1f} '
+              f'{s["converged_after"]:9.1f} {100 * s["not_converged"]:6.1f}%')
+
+
+def write_csv(filename, results):
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run the quests of a study with simulated observers.')
+    parser.add_argument('configs', nargs='+', help='Study JSON files.')
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.05,
+                        help='Distance to the true threshold at which an '
+                        'estimate counts as converged.')
+    parser.add_argument('--threshold',
+                        type=float,
+                        help='True threshold of the observer '
+                        '(default: startVal of each condition).')
+    parser.add_argument('--threshold-sd',
+                        type=float,
+                        default=0.0,
+                        help='Draw the true threshold of every session from '
+                        'a normal distribution with this deviation.')
+    parser.add_argument('--beta',
+                        type=float,
+                        help='Slope of the observer (default: beta of the '
+                        'condition).')
+    parser.add_argument('--delta',
+                        type=float,
+                        help='Lapse rate of the observer (default: delta of '
+                        'the condition).')
+    parser.add_argument('--set',
+                        action='append',
+                        default=[],
+                        metavar='KEY=VALUE',
+                        help='Override a condition value, e.g. nTrials=30.')
+    parser.add_argument('--csv', help='Write the results of every session.')
+    args = parser.parse_args(sys.argv[1:])
+
+    from study import load_config
+    settings, conditions = load_config(*args.configs)
+    for assignment in args.set:
+        key, value = assignment.split('=', 1)
+        for c in conditions:
+            c[key] = type(c[key])(value) if key in c else float(value)
+    settings = {
+        k: v
+        for k, v in settings.items() if k == 'random_reference_probability'
+    }
+    observer_settings = {
+        'threshold': args.threshold,
+        'threshold_sd': args.threshold_sd,
+        'beta': args.beta,
+        'delta': args.delta
+    }
+    results = simulate(conditions, settings, args.sessions, observer_settings,
+                       args.tolerance, args.seed, args.workers)
+    print_summary(summarize(results))
+    if args.csv:
+        write_csv(args.csv, results)
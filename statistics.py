@@ -1,34 +1,68 @@
 import numpy as np
 
 
-def thresholds(data):
-    user = data['user']
-    unique_user = np.unique(data['user'])
-    label = data['label']
-    unique_label = np.unique(label)
-    radius = data['intensity'] * data['filter_radius']
+class Groups:
+    def __init__(self, data, keys=('user', 'label')):
+        self.keys = keys
+        self.unique = {}
+        codes = []
+        for key in keys:
+            self.unique[key], inverse = np.unique(data[key],
+                                                  return_inverse=True)
+            codes.append(inverse)
+        # stable sort, rows of a group keep their order
+        self.order = np.lexsort(codes[::-1])
+        sorted_codes = np.stack([c[self.order] for c in codes])
+        change = np.any(sorted_codes[:, 1:] != sorted_codes[:, :-1], axis=0)
+        self.starts = np.concatenate(([0], np.nonzero(change)[0] + 1))
+        self.ends = np.append(self.starts[1:], len(self.order))
+        if len(self.order) == 0:
+            self.starts = self.ends = np.zeros(0, np.int64)
+        self.codes = sorted_codes[:, self.starts]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def code(self, key):
+        return self.codes[self.keys.index(key)]
+
+    def values(self, key):
+        return self.unique[key][self.code(key)]
 
-    labels = []
-    radii = []
+    def last(self, values):
+        return np.asarray(values)[self.order[self.ends - 1]]
 
-    for user_name in unique_user:
-        for label_name in unique_label:
-            r = radius[(user == user_name) & (label == label_name)]
-            if len(r) > 0:
-                labels.append(label_name)
-                radii.append(r[-1])
+    def series(self, values):
+        values = np.asarray(values)[self.order]
+        return np.split(values, self.starts[1:])
 
-    labels = np.array(labels)
-    radii = np.array(radii)
-    outlier = np.zeros(radii.shape, np.bool)
 
-    quantiles = [np.quantile(radii[labels == label], [0.25, 0.75])
-                 for label in unique_label]
-    iqr = [a[1] - a[0] for a in quantiles]
-    bounds = np.array([(a[0] - 1.5 * i, a[1] + 1.5 * i) for a, i in zip(quantiles, iqr)])
+def group_quantiles(values, codes, q):
+    # np.quantile (linear interpolation) of every group in one sort
+    values = np.asarray(values, np.float64)
+    codes = np.asarray(codes)
+    q = np.atleast_1d(q)
+    values = values[np.lexsort((values, codes))]
+    counts = np.bincount(codes)
+    starts = np.cumsum(counts) - counts
+    position = starts[:, None] + q[None, :] * (counts[:, None] - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, (starts + counts - 1)[:, None])
+    fraction = position - lower
+    return values[lower] + fraction * (values[upper] - values[lower])
 
-    for label, th in zip(unique_label, bounds):
-        r = radii[labels == label]
-        outlier[labels == label] = (r < th[0]) | (th[1] < r)
 
+def iqr_outliers(values, codes, k=1.5):
+    quantiles = group_quantiles(values, codes, [0.25, 0.75])[codes]
+    iqr = quantiles[:, 1] - quantiles[:, 0]
+    return ((values < quantiles[:, 0] - k * iqr) |
+            (quantiles[:, 1] + k * iqr < values))
+
+
+def thresholds(data, groups=None):
+    groups = Groups(data) if groups is None else groups
+    radius = data['intensity'] * data['filter_radius']
+    labels = groups.values('label')
+    radii = groups.last(radius)
+    outlier = iqr_outliers(radii, groups.code('label'))
     return labels, radii, outlier
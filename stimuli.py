@@ -1,26 +1,77 @@
+import argparse
+import itertools
 import numpy as np
+import os
 import psm.filter
+import struct
+import sys
 import time
-import glutil
+import zlib
+
+
+def write_png(filename, image):
+    height, width, channels = image.shape
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+    rows = np.zeros((height, 1 + width * channels), np.uint8)
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data +
+                struct.pack('>I', zlib.crc32(tag + data)))
+
+    with open(filename, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(
+            chunk(b'IHDR',
+                  struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0,
+                              0)))
+        file.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        file.write(chunk(b'IEND', b''))
 
 
 class Generator:
-    def __init__(self, image_size):
+    filter_radius_noise = 0.1
+
+    def __init__(self, image_size, cache=None, headless=False,
+                 backend='opencl', profiling=False):
         self._image_size = image_size
+        self._cache = cache
+        self._renderer_version = (None if cache is None else
+                                  psm.filter.renderer_version(backend))
+        self._headless = headless
+        self._export_directory = None
+        self._export_format = None
+        self._exported_frames = 0
+        self._events = []
+        if backend == 'opencl':
+            psm.filter.init_opencl(not headless, profiling)
 
-        self.reference_image = glutil.Texture2D(image_size, image_size)
-        self.artifact_image = glutil.Texture2D(image_size, image_size)
+        if headless:
+            self._clear_image = psm.filter.Clear(backend, sharing=False)
+            self._draw_line = psm.filter.Line(image_size,
+                                              image_size,
+                                              backend=backend)
+            self._draw_artifact_line = psm.filter.ArtifactLine(
+                image_size, image_size, backend=backend)
+            self.reference_image = self._draw_line.cl_image
+            self.artifact_image = self._draw_artifact_line.cl_image
+        else:
+            import glutil
+            self.reference_image = glutil.Texture2D(image_size, image_size)
+            self.artifact_image = glutil.Texture2D(image_size, image_size)
 
-        self._clear_image = psm.filter.Clear()
+            self._clear_image = psm.filter.Clear()
 
-        self._draw_line = psm.filter.Line(image_size, image_size,
-                                          self.reference_image.obj)
+            self._draw_line = psm.filter.Line(image_size, image_size,
+                                              self.reference_image.obj)
 
-        self._draw_artifact_line = psm.filter.ArtifactLine(
-            image_size, image_size, self.artifact_image.obj)
+            self._draw_artifact_line = psm.filter.ArtifactLine(
+                image_size, image_size, self.artifact_image.obj)
 
+        self._last_update_time = 0.0
+        self._black_screen_timeout = 0.0
         self.settings(1, 0, 0, 0, 0, 0, 1, True, 0.0)
-        self._last_time = time.time()
+        self._last_time = time.monotonic()
         self._fps = 0.0
 
     def __del__(self):
@@ -31,17 +82,42 @@ class Generator:
 
     @property
     def is_showing(self):
-        return time.time(
+        return time.monotonic(
         ) - self._last_update_time >= self._black_screen_timeout
 
+    @property
+    def headless(self):
+        return self._headless
+
+    def export(self, directory, fmt='npy'):
+        if fmt not in ('npy', 'png'):
+            raise ValueError(f'Unknown export format "{fmt}".')
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._export_directory = directory
+        self._export_format = fmt
+        self._exported_frames = 0
+
     def has_selected_artifact(self, selected_left):
         return self.flip_images if selected_left else not self.flip_images
 
     def settings(self, artifact_size, line_angle, filter_radius, filter_noise,
-                 filter_samples, velocity, image_samples, randomize, pause):
+                 filter_samples, velocity, image_samples, randomize, pause,
+                 noise_seed=None, radius_grain=None):
+        # only static stimuli come from the cache, so only they are snapped
+        # to its grid
+        cached = self._cache is not None and velocity == 0
         if randomize:
             # self.image_angle = np.random.rand() * np.pi * 2
             self.image_angle = np.random.randint(4) * np.pi / 2
+            if cached:
+                # cached static stimuli keep a single noise pattern per key
+                self.noise_seed = 0
+            else:
+                self.noise_seed = int(
+                    np.random.randint(2**32, dtype=np.uint64))
+        if noise_seed is not None:
+            self.noise_seed = noise_seed
         image_size = self._image_size
         half_image_size = image_size / 2.0
 
@@ -71,6 +147,9 @@ class Generator:
         if randomize:
             self.rand_x = 100 * (np.random.rand() * 2 - 1)
             self.rand_y = 100 * (np.random.rand() * 2 - 1)
+            if cached:
+                self.rand_x = self._cache.quantize_offset(self.rand_x)
+                self.rand_y = self._cache.quantize_offset(self.rand_y)
 
         self.artifact_size = max(1, artifact_size)
         self.line_x = half_image_size + self.rand_x
@@ -84,6 +163,9 @@ class Generator:
         self.line_vx = line_nx * velocity
         self.line_vy = line_ny * velocity
         self.filter_radius = max(0.0, filter_radius)
+        if cached:
+            self.filter_radius = self._cache.quantize_radius(
+                self.filter_radius, radius_grain)
         self.filter_noise = np.clip(filter_noise, 0, 255) / 255.0
         self.filter_samples = max(0.0, filter_samples)
         self.image_samples = min(max(image_samples, 1), 8)
@@ -91,17 +173,24 @@ class Generator:
         self.min_image_d = min(corner_distances)
         self.max_image_d = max(corner_distances)
         self.frame = 0
+        self._drawn_lines = {}
+        # moving lines look the noise up from fields generated once here
+        for drawer in (self._draw_line, self._draw_artifact_line):
+            drawer.use_noise_field = velocity != 0
+            drawer.update_noise_field(self.noise_seed)
         if pause > 0.0:
-            self._last_update_time = time.time()
+            self._last_update_time = time.monotonic()
             self._black_screen_timeout = pause
 
     def render(self, reference=True, artifact=True):
-        current_time = time.time()
+        self._events = []
+        current_time = time.monotonic()
         elapsed_time = current_time - self._last_time
         self._last_time = current_time
         self._fps = 1.0 / elapsed_time
 
         if current_time - self._last_update_time < self._black_screen_timeout:
+            self._drawn_lines = {}
             if reference:
                 self._clear_image(self._draw_line.cl_image)
             if artifact:
@@ -110,20 +199,16 @@ class Generator:
             return True
 
         # if there is no animation we do not need to render again
-        if self.frame > 0 and self.line_vx == 0 and self.line_vy == 0:
+        is_static = self.line_vx == 0 and self.line_vy == 0
+        if self.frame > 0 and is_static:
             return False
 
-        if reference:
-            self._draw_line(self.current_line_x, self.current_line_y,
-                            self.line_angle, max(1.0, self.filter_radius),
-                            self.filter_noise, self.filter_samples,
-                            self.image_angle)
-        if artifact:
-            self._draw_artifact_line(self.current_line_x, self.current_line_y,
-                                     self.line_angle, self.artifact_size,
-                                     self.filter_radius, self.filter_noise,
-                                     self.filter_samples, 0.1,
-                                     self.image_angle, self.image_samples)
+        if is_static and self._cache is not None:
+            self._draw_cached(reference, artifact)
+        else:
+            self._draw(reference, artifact)
+        if self._export_directory is not None:
+            self._export_frame(reference, artifact)
 
         self.current_line_x += self.line_vx * elapsed_time
         self.current_line_y += self.line_vy * elapsed_time
@@ -139,6 +224,214 @@ class Generator:
         self.frame += 1
         return True
 
+    def _draw(self, reference, artifact):
+        if reference:
+            radius = max(1.0, self.filter_radius)
+            self._draw_line(self.current_line_x,
+                            self.current_line_y,
+                            self.line_angle,
+                            radius,
+                            self.filter_noise,
+                            self.filter_samples,
+                            self.image_angle,
+                            seed=self.noise_seed,
+                            regions=self._band_regions('reference',
+                                                       radius + 1.0))
+            self._events += self._draw_line.events
+        if artifact:
+            # the rotated image samples reach beyond the band of the line
+            half_width = (self.filter_radius *
+                          (1.0 + self.filter_radius_noise / 2) +
+                          self.artifact_size + 1.0
+                          if self.image_samples == 1 else None)
+            self._draw_artifact_line(self.current_line_x,
+                                     self.current_line_y,
+                                     self.line_angle,
+                                     self.artifact_size,
+                                     self.filter_radius,
+                                     self.filter_noise,
+                                     self.filter_samples,
+                                     self.filter_radius_noise,
+                                     self.image_angle,
+                                     self.image_samples,
+                                     seed=self.noise_seed,
+                                     regions=self._band_regions(
+                                         'artifact', half_width))
+            self._events += self._draw_artifact_line.events
+
+    def _band_regions(self, kind, half_width):
+        # a moving line only changes the pixels in the band it moved through
+        # since the last frame, None renders the whole image
+        previous = self._drawn_lines.get(kind)
+        current = (self.current_line_x, self.current_line_y)
+        self._drawn_lines[kind] = current
+        if previous is None or half_width is None:
+            return None
+        distances = [x * self.line_nx + y * self.line_ny
+                     for x, y in (previous, current)]
+        return psm.filter.line_band_regions(self._image_size,
+                                            self._image_size,
+                                            self.line_angle, self.image_angle,
+                                            distances, half_width)
+
+    def _export_frame(self, reference, artifact):
+        for kind, enabled, drawer in (('reference', reference,
+                                       self._draw_line),
+                                      ('artifact', artifact,
+                                       self._draw_artifact_line)):
+            if not enabled:
+                continue
+            filename = os.path.join(
+                self._export_directory,
+                f'{kind}-{self._exported_frames:06d}.{self._export_format}')
+            if self._export_format == 'png':
+                write_png(filename, drawer.read())
+            else:
+                np.save(filename, drawer.read())
+        self._exported_frames += 1
+
+    def _draw_cached(self, reference, artifact):
+        for kind, enabled, drawer in (('reference', reference,
+                                       self._draw_line),
+                                      ('artifact', artifact,
+                                       self._draw_artifact_line)):
+            if not enabled:
+                continue
+            key = self._cache_key(kind)
+            image = self._cache.get(key)
+            if image is not None:
+                drawer.write(image)
+                continue
+            self._draw(kind == 'reference', kind == 'artifact')
+            self._cache.put(key, drawer.read())
+
+    def _cache_key(self, kind):
+        if kind == 'reference':
+            return self._cache.key(kind, self._image_size, 0,
+                                   self.line_angle,
+                                   max(1.0, self.filter_radius),
+                                   self.filter_noise, self.filter_samples, 1,
+                                   self.image_angle, self.rand_x, self.rand_y,
+                                   self._renderer_version)
+        return self._cache.key(kind, self._image_size, self.artifact_size,
+                               self.line_angle, self.filter_radius,
+                               self.filter_noise, self.filter_samples,
+                               self.image_samples, self.image_angle,
+                               self.rand_x, self.rand_y,
+                               self._renderer_version)
+
+    def warm_cache(self, intensities, max_bytes=None, reference=True,
+                   artifact=True):
+        # renders the static stimuli of (condition, intensity) pairs in order
+        # of priority, see quest.proposed_intensities, and stops before they
+        # outgrow max_bytes, so the warm never evicts its own images
+        if self._cache is None:
+            return 0
+        if max_bytes is None or max_bytes > self._cache.max_bytes:
+            max_bytes = self._cache.max_bytes
+        max_images = int(max_bytes // (4 * self._image_size**2 + 128))
+        n_offsets = int(round(100 / self._cache.offset_grain))
+        offsets = np.arange(-n_offsets, n_offsets + 1) * self._cache.offset_grain
+        kinds = [k for k, enabled in (('reference', reference),
+                                      ('artifact', artifact)) if enabled]
+        keys = set()
+        rendered = 0
+        for condition, intensity in intensities:
+            if condition['velocity'] != 0:
+                continue
+            radius_grain = (condition.get('grain', 0.01) *
+                            condition['filter_radius'])
+            for image_angle, rand_x, rand_y in itertools.product(
+                    range(4), offsets, offsets):
+                self.image_angle = image_angle * np.pi / 2
+                self.rand_x = rand_x
+                self.rand_y = rand_y
+                self.settings(condition['artifact_size'],
+                              condition['line_angle'],
+                              condition['filter_radius'] * intensity,
+                              condition['filter_noise'],
+                              condition['filter_samples'],
+                              0.0,
+                              condition['image_samples'],
+                              False,
+                              0.0,
+                              noise_seed=0,
+                              radius_grain=radius_grain)
+                missing = []
+                for kind in kinds:
+                    key = self._cache_key(kind)
+                    if key in keys:
+                        continue
+                    if len(keys) >= max_images:
+                        break
+                    keys.add(key)
+                    if not self._cache.touch(key):
+                        missing.append(kind)
+                self._draw_cached('reference' in missing,
+                                  'artifact' in missing)
+                rendered += len(missing)
+                if len(keys) >= max_images:
+                    break
+            if len(keys) >= max_images:
+                break
+        # leave the generator as a fresh one would be
+        self.settings(1, 0, 0, 0, 0, 0, 1, True, 0.0)
+        return rendered
+
     @property
     def fps(self):
         return int(self._fps)
+
+    @property
+    def events(self):
+        return list(self._events)
+
+    def event_times(self):
+        # OpenCL times of the last render, None until they are complete
+        return psm.filter.event_times(self._events)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Render stimuli without a window and report the FPS.')
+    parser.add_argument('--size', type=int, default=800)
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--backend',
+                        choices=psm.filter.backends,
+                        default='opencl')
+    parser.add_argument('--reference',
+                        help='Render the reference instead of the artifact.',
+                        action='store_true')
+    parser.add_argument('--artifact_size', type=int, default=4)
+    parser.add_argument('--line_angle', type=float, default=10.0)
+    parser.add_argument('--filter_radius', type=float, default=100.0)
+    parser.add_argument('--filter_noise', type=float, default=0.0)
+    parser.add_argument('--filter_samples', type=float, default=100.0)
+    parser.add_argument('--velocity', type=float, default=100.0)
+    parser.add_argument('--image_samples', type=int, default=1)
+    parser.add_argument('--noise_seed',
+                        type=int,
+                        help='Seed of the stimulus noise, random by default.')
+    parser.add_argument('--export', help='Dump every frame into a folder.')
+    parser.add_argument('--format', choices=('npy', 'png'), default='png')
+    args = parser.parse_args(sys.argv[1:])
+
+    generator = Generator(args.size, headless=True, backend=args.backend)
+    generator.settings(args.artifact_size, np.deg2rad(args.line_angle),
+                       args.filter_radius, args.filter_noise,
+                       args.filter_samples, args.velocity, args.image_samples,
+                       True, 0.0, args.noise_seed)
+    if args.export:
+        generator.export(args.export, args.format)
+
+    start_time = time.time()
+    n_frames = 0
+    for _ in range(args.frames):
+        if generator.render(reference=args.reference,
+                            artifact=not args.reference):
+            n_frames += 1
+    if psm.filter.command_queue is not None:
+        psm.filter.command_queue.finish()
+    elapsed_time = time.time() - start_time
+    print(f'{n_frames} frames in {elapsed_time:.3f} s '
+          f'({n_frames / elapsed_time:.2f} FPS)')
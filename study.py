@@ -1,26 +1,34 @@
 import os
 if 'WAYLAND_DISPLAY' in os.environ:
     os.environ['GDK_BACKEND'] = 'x11'
-import gi
-gi.require_version("Gtk", "3.0")
-gi.require_version("Gdk", "3.0")
-from gi.repository import Gtk, Gdk, GLib, GObject
-import glutil
+import cache
 import itertools
 import json
 import numpy as np
 import quest
-import stimuli
-import time
+import timing
+
+
+def import_gtk():
+    import gi
+    gi.require_version("Gtk", "3.0")
+    gi.require_version("Gdk", "3.0")
+    from gi.repository import Gtk
+    return Gtk
 
 
 class Study:
     def __init__(self, glade_filename, settings, conditions, user):
         self.quests = quest.MultiQuest(user, conditions, **settings)
+        self.stimulus_cache = None
+        if settings.get('stimulus_cache', False):
+            self.stimulus_cache = cache.StimulusCache()
         self.stimuli = None
         self.drawer = None
         self.undo_button = None
         self.window = None
+        self.frame_timer = timing.FrameTimer(
+            refresh_interval=1.0 / settings.get('refresh_rate', 60.0))
         self._trial_start_time = None
         self._window_title = ''
         if glade_filename is not None:
@@ -38,6 +46,7 @@ class Study:
             'onUndo': self.on_undo
         }
 
+        Gtk = import_gtk()
         builder = Gtk.Builder()
         builder.add_from_file(glade_filename)
         builder.connect_signals(handlers)
@@ -51,26 +60,28 @@ class Study:
 
     def on_quit(self, *args):
         self.quests.save()
+        self.quests.close()
         if self.window is not None:
-            Gtk.main_quit(*args)
+            import_gtk().main_quit(*args)
 
     def on_different(self, widget, event, *args):
         if not self.stimuli.is_showing:
             return
         self.quests.saw_artifact_response(self.trial_duration, 'image',
-                                          event.x, event.y)
+                                          event.x, event.y, self.trial_info)
         self.setup_next_quest()
 
     def on_cannot_decide(self, widget):
         if not self.stimuli.is_showing:
             return
-        self.quests.cannot_decide_response(self.trial_duration)
+        self.quests.cannot_decide_response(self.trial_duration,
+                                           self.trial_info)
         self.setup_next_quest()
 
     def on_is_line(self, widget):
         if not self.stimuli.is_showing:
             return
-        self.quests.saw_line_response(self.trial_duration)
+        self.quests.saw_line_response(self.trial_duration, self.trial_info)
         self.setup_next_quest()
 
     def on_undo(self, widget):
@@ -80,18 +91,43 @@ class Study:
         self.setup_next_quest()
 
     def on_render(self, gl_area, gl_context):
-        stimuli = self._render_stimuli()
+        timer = self.frame_timer
+        # the events and the presentation of the previous frame are done
+        timer.add_event_times(self.stimuli.event_times(),
+                              timer.frame_count - 1)
+        self._frame_presented(gl_area)
+        timer.begin_frame()
+        with timer.section('render'):
+            stimuli = self._render_stimuli()
         if self.window is not None:
             self.window.set_title(self.window_title)
-        self.drawer.bind()
-        self.drawer.draw(0.0, 0.0, 1.0, 1.0, stimuli)
+        with timer.section('draw'):
+            self.drawer.bind()
+            self.drawer.draw(0.0, 0.0, 1.0, 1.0, stimuli)
+        timer.end_frame()
         if gl_area is not None:
             gl_area.queue_render()
 
+    def _frame_presented(self, gl_area):
+        clock = None if gl_area is None else gl_area.get_frame_clock()
+        if clock is None:
+            return
+        timings = clock.get_timings(clock.get_frame_counter() - 1)
+        if timings is None or not timings.get_complete():
+            return
+        presentation_time = timings.get_presentation_time()
+        if presentation_time > 0:
+            # GDK frame timings are in microseconds of the monotonic clock
+            self.frame_timer.presented(
+                presentation_time * 1e-6,
+                timings.get_refresh_interval() * 1e-6)
+
     def _render_stimuli(self):
         is_random_reference_quest = self.quests.is_reference
-        self.stimuli.render(reference=is_random_reference_quest,
-                            artifact=not is_random_reference_quest)
+        drawn = self.stimuli.render(reference=is_random_reference_quest,
+                                    artifact=not is_random_reference_quest)
+        if drawn and self.stimuli.frame == 1:
+            self.frame_timer.stimulus_onset()
         if is_random_reference_quest:
             return self.stimuli.reference_image
         return self.stimuli.artifact_image
@@ -114,7 +150,8 @@ class Study:
 
     def _update_stimuli(self, intensity, condition):
         pause = self._calculate_pause()
-        self._trial_start_time = time.time() + pause
+        self._trial_start_time = timing.now() + pause
+        self.frame_timer.start_trial(self._trial_start_time)
         self.stimuli.settings(condition['artifact_size'],
                               condition['line_angle'],
                               condition['filter_radius'] * intensity,
@@ -123,7 +160,10 @@ class Study:
                               condition['velocity'],
                               condition['image_samples'],
                               randomize=self.quests.quest_changed,
-                              pause=pause)
+                              pause=pause,
+                              # on the grid the quests already snapped to
+                              radius_grain=condition.get('grain', 0.01) *
+                              condition['filter_radius'])
 
     def _calculate_pause(self):
         if self.quests.quest_changed:
@@ -151,7 +191,11 @@ class Study:
             else:
                 gl_area.get_context().make_current()
                 gl_area_height = int(gl_area.get_allocated_height())
-        self.stimuli = stimuli.Generator(gl_area_height)
+        import glutil
+        import stimuli
+        self.stimuli = stimuli.Generator(gl_area_height,
+                                         cache=self.stimulus_cache,
+                                         profiling=True)
         self.drawer = glutil.DrawTexture()
         self.setup_next_quest()
 
@@ -163,7 +207,19 @@ class Study:
 
     @property
     def trial_duration(self):
-        return time.time() - self._trial_start_time
+        # from the first frame that showed the stimulus if it is known
+        return timing.now() - self.frame_timer.onset_time
+
+    @property
+    def trial_info(self):
+        # the noise seed reproduces the stimulus noise of the trial, radius
+        # and offset are the ones shown, after snapping to the cache grid
+        info = self.frame_timer.trial_statistics()
+        info['noise_seed'] = self.stimuli.noise_seed
+        info['stimulus_radius'] = self.stimuli.filter_radius
+        info['line_offset_x'] = self.stimuli.rand_x
+        info['line_offset_y'] = self.stimuli.rand_y
+        return info
 
     @property
     def window_title(self):
@@ -204,4 +260,4 @@ if __name__ == "__main__":
         configs = ('study-angle2.json', 'study-noise2.json')
     settings, conditions = load_config(*configs)
     study = Study('study.glade', settings, conditions, user)
-    Gtk.main()
\ No newline at end of file
+    import_gtk().main()
\ No newline at end of file
@@ -0,0 +1,144 @@
+import contextlib
+import time
+import numpy as np
+
+sections = ('render', 'kernel', 'acquire_release', 'draw', 'swap')
+_frame_dtype = [('start', np.float64), ('end', np.float64),
+                ('presented', np.float64), ('interval', np.float64)] + [
+                    (name, np.float64) for name in sections
+                ] + [('dropped', bool)]
+
+
+def now():
+    # CLOCK_MONOTONIC on Linux, the clock of the GDK frame timings
+    return time.monotonic()
+
+
+class FrameTimer:
+    def __init__(self, capacity=4096, refresh_interval=1.0 / 60.0,
+                 drop_factor=1.5):
+        self._frames = np.zeros(capacity, _frame_dtype)
+        self._count = 0
+        self._current = None
+        self.refresh_interval = refresh_interval
+        self.drop_factor = drop_factor
+        self._trial_frame = 0
+        self._scheduled_onset = None
+        self._onset_frame = None
+
+    def __len__(self):
+        return min(self._count, len(self._frames))
+
+    @property
+    def frame_count(self):
+        return self._count
+
+    def _row(self, frame):
+        if frame < 0 or frame < self._count - len(self._frames):
+            return None
+        return self._frames[frame % len(self._frames)]
+
+    def begin_frame(self):
+        start = now()
+        previous = self._row(self._count - 1)
+        row = self._frames[self._count % len(self._frames)]
+        row.fill(0)
+        for name in ('end', 'presented', 'interval') + sections:
+            row[name] = np.nan
+        row['start'] = start
+        if previous is not None:
+            row['interval'] = start - previous['start']
+        self._current = row
+
+    def end_frame(self):
+        row = self._current
+        row['end'] = now()
+        row['dropped'] = self._is_dropped(row['interval'])
+        self._current = None
+        self._count += 1
+
+    @contextlib.contextmanager
+    def section(self, name):
+        start = now()
+        try:
+            yield
+        finally:
+            self.add(name, now() - start)
+
+    def add(self, name, duration, frame=None):
+        row = self._current if frame is None else self._row(frame)
+        if row is not None:
+            row[name] = np.nansum([row[name], duration])
+
+    def add_event_times(self, times, frame=None):
+        # OpenCL profiling times of psm.filter events, see Generator.events
+        if times is None:
+            return
+        for name, duration in times.items():
+            if name == 'copy':
+                continue
+            key = 'acquire_release' if name in ('acquire',
+                                                'release') else 'kernel'
+            self.add(key, duration, frame)
+
+    def presented(self, presentation_time, refresh_interval=None, frame=None):
+        # presentation time of a finished frame, the previous one by default
+        if refresh_interval:
+            self.refresh_interval = refresh_interval
+        frame = self._count - 1 if frame is None else frame
+        row, previous = self._row(frame), self._row(frame - 1)
+        if row is None:
+            return
+        row['presented'] = presentation_time
+        row['swap'] = presentation_time - row['end']
+        if previous is not None and np.isfinite(previous['presented']):
+            row['dropped'] = self._is_dropped(presentation_time -
+                                              previous['presented'])
+
+    def _is_dropped(self, interval):
+        return bool(interval > self.drop_factor * self.refresh_interval)
+
+    def frames(self, n=None):
+        n = len(self) if n is None else min(n, len(self))
+        indices = np.arange(self._count - n, self._count) % len(self._frames)
+        return self._frames[indices]
+
+    def start_trial(self, scheduled_onset):
+        self._trial_frame = self._count
+        self._scheduled_onset = scheduled_onset
+        self._onset_frame = None
+
+    def stimulus_onset(self):
+        # called while the first frame that shows the stimulus is rendered
+        if self._onset_frame is None and self._current is not None:
+            self._onset_frame = self._count
+
+    @property
+    def onset_time(self):
+        row = None if self._onset_frame is None else self._row(
+            self._onset_frame)
+        if row is None or self._onset_frame >= self._count:
+            return self._scheduled_onset
+        if np.isfinite(row['presented']):
+            return float(row['presented'])
+        return float(row['end'])
+
+    def trial_statistics(self):
+        first = max(self._onset_frame or self._trial_frame,
+                    self._count - len(self._frames))
+        frames = self.frames(self._count - first)
+        interval = frames['interval'][1:]
+        onset = self.onset_time
+        return {
+            'onset_delay': (np.nan if onset is None or
+                            self._scheduled_onset is None else onset -
+                            self._scheduled_onset),
+            'frames': len(frames),
+            'dropped_frames': int(np.sum(frames['dropped'])),
+            'frame_interval_mean': (float(np.mean(interval))
+                                    if len(interval) else np.nan),
+            'frame_interval_sd': (float(np.std(interval))
+                                  if len(interval) else np.nan),
+            'frame_interval_max': (float(np.max(interval))
+                                   if len(interval) else np.nan)
+        }
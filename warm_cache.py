@@ -0,0 +1,43 @@
+import argparse
+import sys
+import time
+import cache
+import quest
+import stimuli
+import study
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Render the static stimuli the quests of a study propose '
+        'first into the stimulus cache, ahead of the session.')
+    parser.add_argument('configs',
+                        nargs='*',
+                        default=['study-angle2.json', 'study-noise2.json'])
+    parser.add_argument('--size',
+                        type=int,
+                        help='Stimulus size in pixels, it has to match the '
+                        'study window. The stimuli_size of the settings by '
+                        'default.')
+    parser.add_argument('--responses',
+                        type=int,
+                        default=2,
+                        help='Warm the intensities the quests can propose '
+                        'within this many responses.')
+    parser.add_argument('--max_bytes',
+                        type=float,
+                        help='Size limit of the warmed images, at most and by '
+                        'default the size of the cache.')
+    args = parser.parse_args(sys.argv[1:])
+
+    settings, conditions = study.load_config(*args.configs)
+    size = args.size or settings.get('stimuli_size', 800)
+    stimulus_cache = cache.StimulusCache()
+    generator = stimuli.Generator(size, cache=stimulus_cache, headless=True)
+
+    start = time.time()
+    rendered = generator.warm_cache(
+        quest.proposed_intensities(conditions, args.responses),
+        args.max_bytes)
+    print(f'{rendered} images rendered in {time.time() - start:.1f} s, '
+          f'{len(stimulus_cache)} images '
+          f'({stimulus_cache.bytes / 2**30:.2f} GiB) in the cache')